@@ -0,0 +1,99 @@
+"""
+Async render module. Renders Python source code into HTML from
+inside an asyncio event loop without blocking it, either by
+handing control back to the loop between parse steps or by
+running the parser in an executor
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+from lexers import get_lexer
+from source_parser import PythonParser
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from typing import Optional
+
+
+def render_steps(python_parser: PythonParser, cancelled: threading.Event) -> Optional[str]:
+    """
+    Runs a parser to completion in an executor thread, stopping
+    at the next parse step once the render has been cancelled
+
+    Args:
+        python_parser (PythonParser): the parser to run
+        cancelled (threading.Event): set when the render is cancelled
+    Returns:
+        The HTML output, None if cancelled
+    """
+    python_parser.add_html_meta()
+    for _ in python_parser.parse_steps():
+        if cancelled.is_set():
+            return None
+    python_parser.close_html()
+    return python_parser.html
+
+
+async def render_html(
+        source: str,
+        theme: Optional[str] = None,
+        lexer: str = "tokenize",
+        yield_every: int = 4,
+        offload_bytes: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        max_seconds: Optional[float] = None) -> str:
+    """
+    Renders Python source code into a HTML page without blocking
+    the event loop. Source below offload_bytes is parsed in the
+    loop, which gets control back every yield_every parse steps.
+    A step is one logical line, 1024 tokens of a long line or 128
+    lines of a multi-line string.
+    Larger source is parsed in the executor instead. Cancelling
+    the awaiting task stops the parser at its next step
+
+    Args:
+        source (str): the Python source code
+        theme (str): colour scheme for syntax highlighting,
+                     COOL_BLUE when not given
+        lexer (str): name of the lexer engine to tokenize with
+        yield_every (int): parse steps between yields to the loop
+        offload_bytes (int): source size in bytes from which the
+                             parser runs in the executor, None to
+                             always parse in the loop
+        executor (Executor): thread pool to offload to, the
+                             loop's default executor when not given
+        max_seconds (float): time allowed for highlighting
+    Returns:
+        The HTML output
+    Raises:
+        ValueError: if yield_every is less than 1
+        RenderBudgetExceeded: if max_seconds is exceeded
+    """
+    if yield_every < 1:
+        raise ValueError(f"yield_every must be at least 1, got {yield_every}")
+    deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+    tokens = get_lexer(lexer).tokens(source)
+    python_parser = PythonParser(tokens, len(source.splitlines()), theme, deadline)
+    if offload_bytes is not None and len(source.encode("utf-8")) >= offload_bytes:
+        cancelled = threading.Event()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, render_steps, python_parser, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    python_parser.add_html_meta()
+    steps = python_parser.parse_steps()
+    try:
+        for count, _ in enumerate(steps, start=1):
+            if count % yield_every == 0:
+                await asyncio.sleep(0)
+    finally:
+        steps.close()
+    python_parser.close_html()
+    return python_parser.html
@@ -0,0 +1,453 @@
+#!/usr/bin/bash python
+
+"""
+Batch rendering module. Renders many Python files across a
+pool of worker processes with per-file time and size limits
+so a single pathological file cannot stall a worker
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+import tokenize
+
+from multiprocessing.connection import wait
+from typing import Iterator, List, Optional, Tuple
+
+from lexers import LEXERS, get_lexer
+from line_store import LineStore, source_line_count
+from main import get_theme
+from source_parser import PythonParser, RenderBudgetExceeded
+from themes import COOL_BLUE
+from vars import theme_list
+
+
+class RenderLimits:
+    """
+    Per-file limits applied when rendering source code
+    """
+
+    def __init__(
+            self,
+            max_seconds: Optional[float] = 10.0,
+            max_source_bytes: Optional[int] = 1_000_000,
+            max_output_bytes: Optional[int] = 50_000_000,
+            kill_seconds: Optional[float] = None) -> None:
+        """
+        Constructor for the RenderLimits class. A limit of None
+        disables that check
+
+        Args:
+            max_seconds (float): wall time allowed for highlighting
+            max_source_bytes (int): largest source file accepted
+            max_output_bytes (int): largest HTML output allowed
+            kill_seconds (float): wall time after which the worker
+                                  process rendering a file is killed,
+                                  three times max_seconds when not given
+        """
+        self.max_seconds = max_seconds
+        self.max_source_bytes = max_source_bytes
+        self.max_output_bytes = max_output_bytes
+        if kill_seconds is None and max_seconds is not None:
+            kill_seconds = max_seconds * 3
+        self.kill_seconds = kill_seconds
+
+
+class RenderResult:
+    """
+    The outcome of rendering a single source file
+    """
+
+    def __init__(
+            self,
+            path: str,
+            html: Optional[str],
+            seconds: float,
+            status: str = "ok",
+            reason: Optional[str] = None,
+            line_count: Optional[int] = None) -> None:
+        """
+        Constructor for the RenderResult class
+
+        Args:
+            path (str): path of the rendered file
+            html (str): the HTML output, None if cancelled
+            seconds (float): wall time taken to render the file
+            status (str): one of "ok", "degraded" or "cancelled"
+            reason (str): why the file was degraded or cancelled
+            line_count (int): number of lines in the source, None
+                              if it was not read
+        """
+        self.path = path
+        self.html = html
+        self.seconds = seconds
+        self.status = status
+        self.reason = reason
+        self.line_count = line_count
+
+
+def render_source(
+        source: str,
+        theme=COOL_BLUE,
+        limits: Optional[RenderLimits] = None,
+        lexer: str = "tokenize") -> RenderResult:
+    """
+    Renders Python source code into HTML within the limits given.
+    Source that goes over the time or output limits, or that cannot
+    be tokenized, is degraded to plain escaped text with line numbers.
+    The plain text gets its own max_seconds and is cancelled if it
+    goes over. Source over the size limit is cancelled without being
+    rendered
+
+    Args:
+        source (str): the Python source code to render
+        theme (str): colour scheme for syntax highlighting
+        limits (RenderLimits): the limits to apply
+        lexer (str): name of the lexer engine to tokenize with
+    Returns:
+        RenderResult holding the HTML and how it was produced
+    """
+    limits = limits or RenderLimits()
+    start = time.monotonic()
+    source_bytes = len(source.encode("utf-8"))
+    if limits.max_source_bytes is not None and source_bytes > limits.max_source_bytes:
+        reason = f"source size {source_bytes} bytes exceeds limit of {limits.max_source_bytes} bytes"
+        return RenderResult("", None, time.monotonic() - start, "cancelled", reason)
+    lines = source.splitlines(keepends=True)
+    line_count = source_line_count(source)
+    deadline = None
+    if limits.max_seconds is not None:
+        deadline = start + limits.max_seconds
+    tokens = get_lexer(lexer).tokens(source)
+    python_parser = PythonParser(tokens, len(lines), theme, deadline, limits.max_output_bytes)
+    try:
+        html = python_parser.generate_html()
+        return RenderResult("", html, time.monotonic() - start, line_count=line_count)
+    except RenderBudgetExceeded as err:
+        reason = str(err)
+    except (tokenize.TokenError, SyntaxError) as err:
+        reason = f"tokenize failed: {err}"
+    # The fallback gets a time limit of its own so a file that ran out
+    # of time highlighting can still be degraded rather than cancelled
+    fallback_deadline = None
+    if limits.max_seconds is not None:
+        fallback_deadline = time.monotonic() + limits.max_seconds
+    try:
+        html = PythonParser(iter(()), len(lines), theme, fallback_deadline).generate_plain_html(lines)
+    except RenderBudgetExceeded as err:
+        return RenderResult("", None, time.monotonic() - start, "cancelled", f"{reason}, plain output {err}")
+    if limits.max_output_bytes is not None and len(html) > limits.max_output_bytes:
+        return RenderResult("", None, time.monotonic() - start, "cancelled", f"{reason}, plain output too large")
+    return RenderResult("", html, time.monotonic() - start, "degraded", reason, line_count)
+
+
+def render_file(
+        path: str,
+        theme=COOL_BLUE,
+        limits: Optional[RenderLimits] = None,
+        lexer: str = "tokenize") -> RenderResult:
+    """
+    Reads a Python file and renders it into HTML within the
+    limits given. The file size is checked before it is read
+
+    Args:
+        path (str): path of the Python file to render
+        theme (str): colour scheme for syntax highlighting
+        limits (RenderLimits): the limits to apply
+        lexer (str): name of the lexer engine to tokenize with
+    Returns:
+        RenderResult holding the HTML and how it was produced
+    """
+    limits = limits or RenderLimits()
+    try:
+        size = os.path.getsize(path)
+        if limits.max_source_bytes is not None and size > limits.max_source_bytes:
+            reason = f"source size {size} bytes exceeds limit of {limits.max_source_bytes} bytes"
+            return RenderResult(path, None, 0.0, "cancelled", reason)
+        with open(path, 'r', encoding="utf-8") as file:
+            source = file.read()
+    except (OSError, UnicodeDecodeError) as err:
+        return RenderResult(path, None, 0.0, "cancelled", f"read failed: {err}")
+    result = render_source(source, theme, limits, lexer)
+    result.path = path
+    return result
+
+
+def serve_renders(conn, theme: str, limits: RenderLimits, lexer: str) -> None:
+    """
+    Worker process loop. Renders each path received on the
+    connection and sends back the result, until None is received
+
+    Args:
+        conn (Connection): the worker end of the pipe
+        theme (str): colour scheme for syntax highlighting
+        limits (RenderLimits): the limits to apply to each file
+        lexer (str): name of the lexer engine to tokenize with
+    """
+    for path in iter(conn.recv, None):
+        conn.send(render_file(path, theme, limits, lexer))
+
+
+class RenderWorker:
+    """
+    A worker process that renders one file at a time and can be
+    killed and replaced when a file runs past the kill limit
+    """
+
+    def __init__(self, theme: str, limits: RenderLimits, lexer: str) -> None:
+        """
+        Constructor for the RenderWorker class. Starts the process
+
+        Args:
+            theme (str): colour scheme for syntax highlighting
+            limits (RenderLimits): the limits to apply to each file
+            lexer (str): name of the lexer engine to tokenize with
+        """
+        self.args = (theme, limits, lexer)
+        self.task = None
+        self.started = 0.0
+        self.start()
+
+    def start(self) -> None:
+        """
+        Starts a new worker process connected by a pipe
+        """
+        self.conn, worker_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_renders, args=(worker_conn, *self.args), daemon=True)
+        self.process.start()
+        worker_conn.close()
+
+    def submit(self, index: int, path: str) -> None:
+        """
+        Sends a file to the worker process to render
+
+        Args:
+            index (int): position of the file in the batch
+            path (str): path of the file
+        """
+        self.task = (index, path)
+        self.started = time.monotonic()
+        self.conn.send(path)
+
+    def restart(self) -> None:
+        """
+        Kills the worker process and starts a new one in its place
+        """
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.task = None
+        self.start()
+
+    def stop(self) -> None:
+        """
+        Asks the worker process to exit, killing it if it does not
+        """
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def collect_results(
+        workers: List[RenderWorker],
+        kill_seconds: Optional[float]) -> List[Tuple[int, RenderResult]]:
+    """
+    Waits for busy workers to finish a file or run past the kill
+    limit. Workers that run past it, or exit, are replaced and
+    their file is cancelled
+
+    Args:
+        workers (List[RenderWorker]): the worker processes
+        kill_seconds (float): wall time allowed per file
+    Returns:
+        List of (position in the batch, RenderResult) pairs
+    """
+    busy = [worker for worker in workers if worker.task is not None]
+    timeout = None
+    if kill_seconds is not None:
+        timeout = max(0.0, min(worker.started for worker in busy) + kill_seconds - time.monotonic())
+    ready = wait([worker.conn for worker in busy], timeout)
+    done = []
+    for worker in busy:
+        index, path = worker.task
+        seconds = time.monotonic() - worker.started
+        if worker.conn in ready:
+            try:
+                done.append((index, worker.conn.recv()))
+                worker.task = None
+                continue
+            except EOFError:
+                reason = "worker process exited"
+        elif kill_seconds is not None and seconds >= kill_seconds:
+            reason = f"worker killed after {seconds:.1f} s"
+        else:
+            continue
+        done.append((index, RenderResult(path, None, seconds, "cancelled", reason)))
+        worker.restart()
+    return done
+
+
+def render_batch(
+        paths: List[str],
+        theme=COOL_BLUE,
+        limits: Optional[RenderLimits] = None,
+        workers: Optional[int] = None,
+        lexer: str = "tokenize") -> Iterator[RenderResult]:
+    """
+    Renders many Python files across a pool of worker processes.
+    Results are yielded in the same order as the paths. A worker
+    still busy with a file after limits.kill_seconds is killed and
+    replaced, and the file is cancelled
+
+    Args:
+        paths (List[str]): paths of the Python files to render
+        theme (str): colour scheme for syntax highlighting
+        limits (RenderLimits): the limits to apply to each file
+        workers (int): number of worker processes
+        lexer (str): name of the lexer engine to tokenize with
+    Returns:
+        Iterator of RenderResult objects
+    """
+    limits = limits or RenderLimits()
+    count = min(workers or os.cpu_count() or 1, len(paths))
+    pool = [RenderWorker(theme, limits, lexer) for _ in range(count)]
+    finished = {}
+    submitted = 0
+    next_index = 0
+    try:
+        while next_index < len(paths):
+            # Finished results wait for earlier files, so only a few
+            # files per worker are let ahead of the next one to yield
+            for worker in pool:
+                if worker.task is None and submitted < len(paths) and len(finished) < count * 4:
+                    worker.submit(submitted, paths[submitted])
+                    submitted += 1
+            finished.update(collect_results(pool, limits.kill_seconds))
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        for worker in pool:
+            worker.stop()
+
+
+def get_args() -> argparse.Namespace:
+    """
+    Gets command line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='Paths of the Python files to be parsed into HTML')
+    parser.add_argument('-t', '--theme', dest='theme', help='Syntax highlighting theme to use. Defaults to COOL_BLUE')
+    parser.add_argument('-d', '--dest', default=os.getcwd(), help='Directory to write the HTML files to')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes')
+    parser.add_argument('-l', '--lexer', default='tokenize', choices=list(LEXERS), help='Lexer engine to use')
+    parser.add_argument('--sqlite', metavar='DB', help='Write the lines of changed files to a SQLite database instead')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='Render time limit per file')
+    parser.add_argument('--max-source', type=int, default=1_000_000, help='Source size limit per file in bytes')
+    parser.add_argument('--max-output', type=int, default=50_000_000, help='Output size limit per file in bytes')
+    parser.add_argument('--kill-seconds', type=float,
+                        help='Wall time after which a worker rendering a file is killed. Defaults to 3x --max-seconds')
+    args = parser.parse_args()
+    theme = args.theme
+    if theme and theme.lower() not in theme_list:
+        parser.error(f"\n\n[-] Unknown theme: {theme}. See https://github.com/sedexdev/source_page for more\n")
+    if not os.path.isdir(args.dest):
+        parser.error('\n\n[-] Destination directory not found\n')
+    return args
+
+
+def report(result: RenderResult) -> RenderResult:
+    """
+    Prints the outcome of rendering a file
+
+    Args:
+        result (RenderResult): the result to report
+    Returns:
+        The same result
+    """
+    if result.status == "ok":
+        print(f"[+] {result.path}: ok ({result.seconds * 1000:.1f} ms)")
+    else:
+        print(f"[-] {result.path}: {result.status} ({result.reason})")
+    return result
+
+
+def export_to_store(args: argparse.Namespace, theme: str, limits: RenderLimits) -> None:
+    """
+    Renders the files that changed since they were last stored
+    and writes their lines to the SQLite database
+
+    Args:
+        args (argparse.Namespace): the command line arguments
+        theme (str): colour scheme for syntax highlighting
+        limits (RenderLimits): the limits to apply to each file
+    """
+    store = LineStore(args.sqlite)
+    try:
+        theme_name = args.theme.lower() if args.theme else "cool_blue"
+        removed = store.remove_missing()
+        if removed:
+            print(f"[+] Removed {removed} deleted files from {args.sqlite}")
+        changed = store.changed_files(args.paths, theme_name, args.lexer)
+        print(f"[+] {len(changed)} of {len(args.paths)} files changed")
+        paths = [path for path, _, _ in changed]
+        results = map(report, render_batch(paths, theme, limits, args.workers, args.lexer))
+        written = store.write_results(zip(changed, results), theme_name, args.lexer)
+        print(f"[+] Wrote {written} files to {args.sqlite}")
+    finally:
+        store.close()
+
+
+def output_paths(paths: List[str], dest: str) -> List[str]:
+    """
+    Gets the HTML file path for each Python file. The directories
+    of the files below their common parent are kept under dest,
+    so files with the same name in different directories, such as
+    __init__.py, do not overwrite each other
+
+    Args:
+        paths (List[str]): paths of the Python files
+        dest (str): directory to write the HTML files to
+    Returns:
+        List of HTML file paths in the same order as paths
+    """
+    dirs = [os.path.dirname(os.path.abspath(path)) for path in paths]
+    root = os.path.commonpath(dirs) if dirs else ""
+    return [
+        os.path.normpath(os.path.join(dest, os.path.relpath(dir_path, root),
+                                      f"{os.path.splitext(os.path.basename(path))[0]}.html"))
+        for path, dir_path in zip(paths, dirs)
+    ]
+
+
+def main() -> None:
+    """
+    Main function for batch rendering. Writes a HTML file for
+    each Python file given, or the lines of each changed file to
+    a SQLite database, and reports any file that was degraded or
+    cancelled along with the reason
+    """
+    args = get_args()
+    theme = get_theme(args.theme.lower()) if args.theme else COOL_BLUE
+    limits = RenderLimits(args.max_seconds, args.max_source, args.max_output, args.kill_seconds)
+    if args.sqlite:
+        export_to_store(args, theme, limits)
+        return
+    results = render_batch(args.paths, theme, limits, args.workers, args.lexer)
+    for result, out_path in zip(results, output_paths(args.paths, args.dest)):
+        if result.html is not None:
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'w', encoding="utf-8") as file:
+                file.write(result.html)
+        report(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,436 @@
+#!/usr/bin/bash python
+
+"""
+Benchmark module for the SourcePage parser
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tokenize
+
+from async_render import render_html
+from lexers import LEXERS, get_lexer
+from payload import generate_runs_html
+from source_parser import PythonParser
+
+# Escape heavy Python source used to measure the cost of HTML escaping
+ESCAPE_HEAVY_SOURCE = '''
+def compare(a, b, mask):
+    # check that a < b && b > 0 <here>
+    if a < b and b > 0 or a <= mask >= b:
+        return (a & mask) | (b >> 2) << 1
+    html = "<div class='x'>&amp;</div>" + '<span>&lt;</span>'
+    return a >= b != mask
+
+
+'''
+
+# Name heavy Python source used to measure function and class name highlighting
+NAME_HEAVY_SOURCE = '''
+class Reader(BaseReader):
+    def read(self, path, size):
+        data = open_file(path).read(size)
+        return decode(data, self.encoding)
+
+    def lines(self, path):
+        for line in split_lines(self.read(path, limit)):
+            yield strip(line), count(line)
+
+
+def load(name, loader=Reader):
+    return loader(name).lines(resolve(name, base))
+'''
+
+# Largest share of the parse time HTML escaping may take on ESCAPE_HEAVY_SOURCE
+ESCAPE_TARGET_PERCENT = 5.0
+
+# Interval of the ticker used to measure event loop latency
+TICK_SECONDS = 0.001
+
+# Renders in flight at once while the event loop latency is measured
+RENDERS_IN_FLIGHT = 4
+
+# Import time the command line tool may add on top of a bare interpreter,
+# as a multiple of the bare interpreter's own import time so the budget
+# scales with the speed of the machine
+STARTUP_BUDGET_RATIO = 3.0
+
+
+def render(source: str, lexer: str = "tokenize", semantic: bool = True) -> str:
+    """
+    Renders Python source code into a HTML string
+
+    Args:
+        source (str): the Python source code to render
+        lexer (str): name of the lexer engine to tokenize with
+        semantic (bool): highlight function and class names
+    Returns:
+        The generated HTML
+    """
+    tokens = get_lexer(lexer).tokens(source)
+    return PythonParser(tokens, source.count("\n"), semantic=semantic).generate_html()
+
+
+def time_render(source: str, lexer: str = "tokenize", semantic: bool = True) -> float:
+    """
+    Gets the time taken to render the source code
+
+    Args:
+        source (str): the Python source code to render
+        lexer (str): name of the lexer engine to tokenize with
+        semantic (bool): highlight function and class names
+    Returns:
+        The render time in seconds
+    """
+    start = time.perf_counter()
+    render(source, lexer, semantic)
+    return time.perf_counter() - start
+
+
+def lex_tokens(source: str) -> list:
+    """
+    Lexes Python source code up front so benchmarks can time the
+    parser without the lexer
+
+    Args:
+        source (str): the Python source code
+    Returns:
+        List of tokens
+    """
+    return list(get_lexer("tokenize").tokens(source))
+
+
+def time_parse(tokens: list, rounds: int, **options) -> float:
+    """
+    Gets the time taken to parse pre-lexed tokens a number of
+    times. Short sources are used so the time is spent in the
+    parser's own code rather than in building one long string
+
+    Args:
+        tokens (list): tokens from lex_tokens
+        rounds (int): the number of times to parse the tokens
+        options: keyword arguments for PythonParser
+    Returns:
+        The parse time in seconds
+    """
+    lines = tokens[-1].start[0]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        PythonParser(iter(tokens), lines, "", **options).parse()
+    return time.perf_counter() - start
+
+
+def bench_escape(repeat: int) -> bool:
+    """
+    Compares the time PythonParser takes to parse escape heavy
+    source code with and without HTML escaping, against the
+    target in ESCAPE_TARGET_PERCENT. Runs are interleaved in
+    pairs and the median ratio is used, as the difference is
+    smaller than the noise between single runs
+
+    Args:
+        repeat (int): the number of pairs of runs
+    Returns:
+        Boolean stating whether the overhead is within target
+    """
+    tokens = lex_tokens(ESCAPE_HEAVY_SOURCE)
+    unescaped, escaped = [], []
+    for _ in range(repeat):
+        unescaped.append(time_parse(tokens, 200, escape=False))
+        escaped.append(time_parse(tokens, 200, escape=True))
+    overhead = (statistics.median(e / u for e, u in zip(escaped, unescaped)) - 1) * 100
+    print(f"[+] No escaping:       {statistics.median(unescaped) * 1000:.2f} ms")
+    print(f"[+] With escaping:     {statistics.median(escaped) * 1000:.2f} ms")
+    if overhead <= ESCAPE_TARGET_PERCENT:
+        print(f"[+] Within target: {overhead:.2f}% overhead, target {ESCAPE_TARGET_PERCENT:.2f}%")
+        return True
+    print(f"[-] Over target: {overhead:.2f}% overhead, target {ESCAPE_TARGET_PERCENT:.2f}%")
+    return False
+
+
+def bench_lexers(repeat: int) -> None:
+    """
+    Compares each lexer engine on the source of the tokenize
+    module, both tokenizing alone and rendering the HTML
+
+    Args:
+        repeat (int): the number of times to run each engine
+    """
+    with open(tokenize.__file__, 'r', encoding="utf-8") as file:
+        source = file.read()
+    print(f"[+] Source: {tokenize.__file__} ({source.count(chr(10))} lines)")
+    for name in LEXERS:
+        lexer = get_lexer(name)
+        lex_time = render_time = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = sum(1 for _ in lexer.tokens(source))
+            lex_time = min(lex_time, time.perf_counter() - start)
+            render_time = min(render_time, time_render(source, name))
+        print(f"[+] {name:<10} tokenize: {lex_time * 1000:7.2f} ms ({count} tokens)  render: {render_time * 1000:7.2f} ms")
+
+
+def bench_semantic(repeat: int) -> None:
+    """
+    Compares the time PythonParser takes to parse name heavy
+    source code with and without function and class name
+    highlighting, reported per token. Runs are interleaved in
+    pairs and the median difference is used
+
+    Args:
+        repeat (int): the number of pairs of runs
+    """
+    tokens = lex_tokens(NAME_HEAVY_SOURCE)
+    rounds = 200
+    count = len(tokens) * rounds
+    plain, semantic = [], []
+    for _ in range(repeat):
+        plain.append(time_parse(tokens, rounds, semantic=False))
+        semantic.append(time_parse(tokens, rounds, semantic=True))
+    overhead = statistics.median(s - p for s, p in zip(semantic, plain))
+    print(f"[+] Tokens:              {len(tokens)}")
+    print(f"[+] Plain names:         {statistics.median(plain) * 1e9 / count:.0f} ns per token")
+    print(f"[+] Semantic names:      {statistics.median(semantic) * 1e9 / count:.0f} ns per token")
+    print(f"[+] Semantic overhead:   {overhead * 1e9 / count:.0f} ns per token")
+
+
+def import_times(args: list, env: dict) -> dict:
+    """
+    Runs Python with -X importtime and collects the import
+    times it reports
+
+    Args:
+        args (list): arguments to pass to the interpreter
+        env (dict): environment for the interpreter
+    Returns:
+        Module names mapped to (self, cumulative) times in microseconds
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True,
+        check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        fields = line.replace("import time:", "", 1).split("|")
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def bench_startup(repeat: int) -> bool:
+    """
+    Measures the start up cost of rendering a 20 line snippet
+    with main.py. Import times come from -X importtime and are
+    compared with a bare interpreter so only the cost added by the
+    tool is counted. The budget is STARTUP_BUDGET_RATIO times the
+    import time of the bare interpreter
+
+    Args:
+        repeat (int): the number of times to run the tool
+    Returns:
+        Boolean stating whether the start up cost is within budget
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as file:
+        file.write(ESCAPE_HEAVY_SOURCE * 2)
+    try:
+        args = [main_path, "-p", file.name]
+        # Warm up run so bytecode caches are written
+        import_times(args, env)
+        bare, tool, wall = [], [], []
+        slowest = {}
+        for _ in range(repeat):
+            bare.append(sum(self for self, _ in import_times(["-c", "pass"], env).values()) / 1000)
+            start = time.perf_counter()
+            times = import_times(args, env)
+            wall.append((time.perf_counter() - start) * 1000)
+            tool.append(sum(self for self, _ in times.values()) / 1000)
+            slowest = times
+    finally:
+        os.remove(file.name)
+    added = statistics.median(tool) - statistics.median(bare)
+    print(f"[+] Wall time:            {statistics.median(wall):.2f} ms")
+    print(f"[+] Bare interpreter:     {statistics.median(bare):.2f} ms of imports")
+    print(f"[+] main.py:              {statistics.median(tool):.2f} ms of imports")
+    print("[+] Slowest imports:")
+    for name, (_, cumulative) in sorted(slowest.items(), key=lambda item: item[1][1], reverse=True)[:5]:
+        print(f"    {cumulative / 1000:7.2f} ms  {name}")
+    budget = statistics.median(bare) * STARTUP_BUDGET_RATIO
+    if added <= budget:
+        print(f"[+] Within budget: {added:.2f} ms added, budget {budget:.2f} ms "
+              f"({STARTUP_BUDGET_RATIO:g}x bare interpreter)")
+        return True
+    print(f"[-] Over budget: {added:.2f} ms added, budget {budget:.2f} ms ({STARTUP_BUDGET_RATIO:g}x bare interpreter)")
+    return False
+
+
+def bench_payload(repeat: int) -> None:
+    """
+    Compares the transfer size of the span and run formats
+    against the source, raw and gzip compressed, along with the
+    time taken to build each
+
+    Args:
+        repeat (int): the number of times to render
+    """
+    with open(tokenize.__file__, 'r', encoding="utf-8") as file:
+        source = file.read()
+    spans_time = runs_time = float("inf")
+    for _ in range(repeat):
+        spans_time = min(spans_time, time_render(source, "regex"))
+        start = time.perf_counter()
+        runs = generate_runs_html(source, lexer="regex")
+        runs_time = min(runs_time, time.perf_counter() - start)
+    outputs = {"source": source, "spans": render(source, "regex"), "runs": runs}
+    for name, text in outputs.items():
+        data = text.encode("utf-8")
+        print(f"[+] {name:<7} {len(data):9,} bytes  gzip: {len(gzip.compress(data)):9,} bytes")
+    print(f"[+] Render time spans: {spans_time * 1000:.2f} ms  runs: {runs_time * 1000:.2f} ms")
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    Gets a percentile of a list of values by the nearest rank
+
+    Args:
+        values (list): the values, in any order
+        pct (float): the percentile, from 0 to 100
+    Returns:
+        The value at that percentile
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def measure_loop_latency(render_coro, renders: int) -> tuple:
+    """
+    Runs renders in the event loop, RENDERS_IN_FLIGHT at a time,
+    alongside a ticker that sleeps for TICK_SECONDS at a time and
+    records how late each wake up is
+
+    Args:
+        render_coro: coroutine function that renders once
+        renders (int): total number of renders
+    Returns:
+        Tuple of the wake up delays and the wall time of the renders
+    """
+    delays = []
+    done = asyncio.Event()
+    slots = asyncio.Semaphore(RENDERS_IN_FLIGHT)
+
+    async def ticker() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK_SECONDS)
+            delays.append(time.perf_counter() - start - TICK_SECONDS)
+
+    async def limited() -> None:
+        async with slots:
+            await render_coro()
+
+    ticking = asyncio.ensure_future(ticker())
+    await asyncio.sleep(TICK_SECONDS)
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(renders)))
+    wall = time.perf_counter() - start
+    done.set()
+    await ticking
+    return delays, wall
+
+
+def docstring_heavy_source(functions: int = 2, lines: int = 8000) -> str:
+    """
+    Builds Python source code made mostly of long docstrings,
+    where a single token spans thousands of lines
+
+    Args:
+        functions (int): the number of functions
+        lines (int): the number of lines in each docstring
+    Returns:
+        The Python source code
+    """
+    body = "\n".join(f"    Line {number} of the docstring, with <markup> & text." for number in range(lines))
+    return "".join(f'def function_{index}():\n    """\n{body}\n    """\n\n\n' for index in range(functions))
+
+
+def bench_loop_latency(repeat: int) -> None:
+    """
+    Measures event loop latency percentiles while large files
+    are rendered in the loop, for the blocking generate_html
+    call, the cooperative async API and the executor offload.
+    Code heavy and docstring heavy files are both measured
+
+    Args:
+        repeat (int): the number of renders per measurement
+    """
+    with open(tokenize.__file__, 'r', encoding="utf-8") as file:
+        sources = {"code": file.read() * 2, "docstrings": docstring_heavy_source()}
+    print(f"[+] {repeat} renders, {RENDERS_IN_FLIGHT} in flight, {TICK_SECONDS * 1000:.0f} ms ticker")
+    for source_name, source in sources.items():
+        lines = len(source.splitlines())
+
+        async def blocking() -> None:
+            PythonParser(get_lexer("regex").tokens(source), lines).generate_html()
+
+        async def cooperative() -> None:
+            await render_html(source, lexer="regex")
+
+        async def offloaded() -> None:
+            await render_html(source, lexer="regex", offload_bytes=0)
+
+        print(f"[+] Source: {source_name}, {len(source):,} bytes, {lines:,} lines")
+        for name, render_coro in (("blocking", blocking), ("async", cooperative), ("offload", offloaded)):
+            delays, wall = asyncio.run(measure_loop_latency(render_coro, repeat))
+            print(f"    {name:<9} p50: {percentile(delays, 50) * 1000:7.2f} ms  "
+                  f"p95: {percentile(delays, 95) * 1000:7.2f} ms  "
+                  f"p99: {percentile(delays, 99) * 1000:7.2f} ms  "
+                  f"max: {max(delays) * 1000:7.2f} ms  renders: {wall * 1000:8.1f} ms")
+
+
+BENCHMARKS = {
+    "escape": bench_escape,
+    "lexers": bench_lexers,
+    "semantic": bench_semantic,
+    "payload": bench_payload,
+    "loop-latency": bench_loop_latency,
+    "startup": bench_startup
+}
+
+
+def main() -> None:
+    """
+    Main function for the benchmarks. Runs the benchmarks
+    named on the command line, or all of them, and exits with
+    status 1 if any benchmark went over its budget or target
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('names', nargs='*', help=f'Benchmarks to run: {", ".join(BENCHMARKS)}. Defaults to all')
+    parser.add_argument('-r', '--repeat', type=int, default=20, help='Number of runs per measurement')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'\n\n[-] Unknown benchmark: {name}\n')
+    failed = []
+    for name in args.names or BENCHMARKS:
+        print(f"\n[+] Running benchmark: {name}")
+        if BENCHMARKS[name](args.repeat) is False:
+            failed.append(name)
+    if failed:
+        print(f"\n[-] Over budget or target: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
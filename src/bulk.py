@@ -0,0 +1,225 @@
+#!/usr/bin/bash python
+
+"""
+Bulk snippet module. Renders large numbers of small code
+snippets read as JSON lines into HTML fragments, using a
+pool of worker processes that each keep a warm parser
+pipeline and work through chunks of records at a time
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tokenize
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Iterator, List, Optional
+
+from lexers import LEXERS, get_lexer
+from main import get_theme
+from source_parser import PythonParser, RenderBudgetExceeded, scope_theme, theme_class
+from vars import theme_list
+
+# Lexer engine of this worker process, set up once by init_worker
+_LEXER = None
+
+
+def init_worker(lexer: str) -> None:
+    """
+    Sets up the lexer engine for a worker process and runs it
+    once so any compiled patterns are ready for the first chunk
+
+    Args:
+        lexer (str): name of the lexer engine to use
+    """
+    global _LEXER
+    _LEXER = get_lexer(lexer)
+    for _ in _LEXER.tokens("pass\n"):
+        pass
+
+
+def render_snippet(source: str, theme_name: str, max_seconds: Optional[float]) -> str:
+    """
+    Renders a snippet of Python source code into a HTML fragment.
+    Snippets that cannot be tokenized or go over the time limit
+    are rendered as plain escaped text with line numbers
+
+    Args:
+        source (str): the Python source code
+        theme_name (str): name of the theme for the fragment
+        max_seconds (float): time allowed for highlighting
+    Returns:
+        The HTML fragment
+    """
+    lines = source.splitlines(keepends=True)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    python_parser = PythonParser(_LEXER.tokens(source), len(lines), "", deadline)
+    try:
+        return python_parser.generate_fragment(theme_name)
+    except (RenderBudgetExceeded, SyntaxError, tokenize.TokenError):
+        return PythonParser(iter(()), len(lines), "").generate_fragment(theme_name, lines)
+
+
+def render_record(line: str, max_seconds: Optional[float]) -> str:
+    """
+    Renders one JSON record of the form {id, source, theme}
+    into a JSON result of the form {id, html}. Records that
+    cannot be rendered get a null html and an error instead,
+    so one bad record never stops the rest of the run
+
+    Args:
+        line (str): the JSON record
+        max_seconds (float): time allowed for highlighting
+    Returns:
+        The JSON result
+    """
+    try:
+        record = json.loads(line)
+    except ValueError as err:
+        return json.dumps({"id": None, "html": None, "error": f"invalid JSON: {err}"})
+    if not isinstance(record, dict):
+        return json.dumps({"id": None, "html": None, "error": "record is not a JSON object"})
+    ident = record.get("id")
+    source = record.get("source")
+    theme_name = record.get("theme") or "cool_blue"
+    if not isinstance(source, str):
+        return json.dumps({"id": ident, "html": None, "error": "missing source"})
+    if not isinstance(theme_name, str) or theme_name.lower() not in theme_list:
+        return json.dumps({"id": ident, "html": None, "error": f"unknown theme: {theme_name}"})
+    try:
+        html = render_snippet(source, theme_name.lower(), max_seconds)
+    except Exception as err:
+        return json.dumps({"id": ident, "html": None, "error": f"render failed: {type(err).__name__}: {err}"})
+    return json.dumps({"id": ident, "html": html})
+
+
+def render_chunk(lines: List[str], max_seconds: Optional[float]) -> str:
+    """
+    Renders a chunk of JSON records in a worker process. The
+    results come back as one string to keep the cost of sending
+    them between processes low
+
+    Args:
+        lines (List[str]): the JSON records
+        max_seconds (float): time allowed for highlighting each snippet
+    Returns:
+        The JSON results, one per line
+    """
+    return "".join(f"{render_record(line, max_seconds)}\n" for line in lines)
+
+
+def read_chunks(file: IO, size: int) -> Iterator[List[str]]:
+    """
+    Reads JSON records from a file in chunks, skipping blank lines
+
+    Args:
+        file (IO): the file to read
+        size (int): number of records per chunk
+    Returns:
+        Iterator of lists of records
+    """
+    chunk = []
+    for line in file:
+        if line.strip():
+            chunk.append(line)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def render_chunks(
+        chunks: Iterator[List[str]],
+        workers: Optional[int],
+        lexer: str,
+        max_seconds: Optional[float]) -> Iterator[str]:
+    """
+    Renders chunks of records across a pool of worker processes,
+    yielding the results in input order. Only a few chunks per
+    worker are in flight at once so memory use stays flat however
+    many records are read
+
+    Args:
+        chunks (Iterator[List[str]]): chunks of JSON records
+        workers (int): number of worker processes, 0 to render in
+                       this process
+        lexer (str): name of the lexer engine to use
+        max_seconds (float): time allowed for highlighting each snippet
+    Returns:
+        Iterator of rendered chunks
+    """
+    if workers == 0:
+        init_worker(lexer)
+        for chunk in chunks:
+            yield render_chunk(chunk, max_seconds)
+        return
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(lexer,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(render_chunk, chunk, max_seconds))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def theme_stylesheet() -> str:
+    """
+    Gets the stylesheet for every theme, each scoped under the
+    root class used by the fragments
+
+    Returns:
+        The combined stylesheet
+    """
+    return "\n".join(scope_theme(get_theme(name), theme_class(name)) for name in theme_list)
+
+
+def get_args() -> argparse.Namespace:
+    """
+    Gets command line arguments from the user
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', nargs='?', default='-', help='JSON lines file of {id, source, theme} records. '
+                                                            'Defaults to stdin')
+    parser.add_argument('-o', '--output', default='-', help='File to write {id, html} results to. Defaults to stdout')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes, 0 to render in this process')
+    parser.add_argument('-c', '--chunk-size', type=int, default=256, help='Number of records sent to a worker at once')
+    parser.add_argument('-l', '--lexer', default='regex', choices=list(LEXERS), help='Lexer engine to use')
+    parser.add_argument('--max-seconds', type=float, default=10.0, help='Render time limit per snippet')
+    parser.add_argument('--css', help='Write the stylesheet for the fragments of every theme to this file')
+    args = parser.parse_args()
+    if args.input != '-' and not os.path.isfile(args.input):
+        parser.error('\n\n[-] File not found\n')
+    if args.chunk_size < 1:
+        parser.error('\n\n[-] Chunk size must be at least 1\n')
+    return args
+
+
+def main() -> None:
+    """
+    Main function for bulk snippet rendering
+    """
+    args = get_args()
+    if args.css:
+        with open(args.css, 'w', encoding="utf-8") as file:
+            file.write(theme_stylesheet())
+    source = sys.stdin if args.input == '-' else open(args.input, 'r', encoding="utf-8")
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding="utf-8")
+    try:
+        for rendered in render_chunks(read_chunks(source, args.chunk_size), args.workers, args.lexer,
+                                      args.max_seconds):
+            output.write(rendered)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
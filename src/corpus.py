@@ -0,0 +1,268 @@
+#!/usr/bin/bash python
+
+"""
+Corpus harness module. Renders every Python file in a
+directory tree, the local CPython standard library by
+default, checking that the text of the HTML output matches
+the source and ranking files by render time
+"""
+
+import argparse
+import os
+import sysconfig
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from itertools import repeat
+from typing import Iterator, List, Optional, Tuple
+
+from batch import RenderLimits, render_file
+from lexers import LEXERS, diff_lexers
+
+
+class CodeTextExtractor(HTMLParser):
+    """
+    Collects the text content of each code line element in the
+    HTML output, leaving out the line number gutters
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor for the CodeTextExtractor class
+        """
+        super().__init__(convert_charrefs=True)
+        self.lines = []
+        self.current = None
+        self.in_gutter = False
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple]) -> None:
+        """
+        Starts a new line for code line elements and marks the
+        start of line number gutters
+
+        Args:
+            tag (str): name of the tag
+            attrs (List[Tuple]): the attributes of the tag
+        """
+        classes = dict(attrs).get("class", "") or ""
+        if tag == "code" and "code-line" in classes.split():
+            self.current = []
+        elif tag == "span" and "line-number" in classes.split():
+            self.in_gutter = True
+
+    def handle_endtag(self, tag: str) -> None:
+        """
+        Finishes the current line or gutter
+
+        Args:
+            tag (str): name of the tag
+        """
+        if tag == "code" and self.current is not None:
+            self.lines.append("".join(self.current))
+            self.current = None
+        elif tag == "span":
+            self.in_gutter = False
+
+    def handle_data(self, data: str) -> None:
+        """
+        Adds text inside a code line to the current line
+
+        Args:
+            data (str): the text content
+        """
+        if self.current is not None and not self.in_gutter:
+            self.current.append(data)
+
+
+def normalise(text: str) -> str:
+    """
+    Maps non-breaking spaces, used by the parser for whitespace,
+    back to regular spaces
+
+    Args:
+        text (str): the text to normalise
+    """
+    return text.replace("\xa0", " ")
+
+
+def html_lines(html: str) -> List[str]:
+    """
+    Gets the text content of each code line in the HTML output
+
+    Args:
+        html (str): the HTML output string
+    Returns:
+        List of lines with non-breaking spaces normalised
+    """
+    extractor = CodeTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return [normalise(line) for line in extractor.lines]
+
+
+def source_lines(source: str) -> List[str]:
+    """
+    Splits the source code into lines in the same way the
+    tokenizer reads them
+
+    Args:
+        source (str): the Python source code
+    Returns:
+        List of lines with non-breaking spaces normalised
+    """
+    lines = normalise(source).split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def first_difference(expected: List[str], actual: List[str]) -> Optional[str]:
+    """
+    Describes the first line where the rendered text differs
+    from the source code
+
+    Args:
+        expected (List[str]): lines of the source code
+        actual (List[str]): lines of the rendered text
+    Returns:
+        Description of the difference, None if the lines match
+    """
+    for number, (want, got) in enumerate(zip(expected, actual), start=1):
+        if want != got:
+            return f"line {number}: expected {want!r}, got {got!r}"
+    if len(expected) != len(actual):
+        return f"expected {len(expected)} lines, got {len(actual)}"
+    return None
+
+
+def check_file(path: str, limits: RenderLimits, lexer: str = "tokenize") -> Tuple[str, float, str, Optional[str]]:
+    """
+    Renders a file and checks the round trip invariant: the
+    text content of the HTML minus the gutters equals the source
+
+    Args:
+        path (str): path of the Python file to check
+        limits (RenderLimits): the limits to apply when rendering
+        lexer (str): name of the lexer engine to tokenize with
+    Returns:
+        Tuple of path, render time, status and problem found
+    """
+    result = render_file(path, limits=limits, lexer=lexer)
+    if result.status != "ok":
+        return path, result.seconds, result.status, result.reason
+    with open(path, 'r', encoding="utf-8") as file:
+        source = file.read()
+    problem = first_difference(source_lines(source), html_lines(result.html))
+    return path, result.seconds, "mismatch" if problem else "ok", problem
+
+
+def diff_file(path: str, lexer: str) -> Tuple[str, float, str, Optional[str]]:
+    """
+    Checks that a lexer engine produces the same token stream
+    as tokenize for a file
+
+    Args:
+        path (str): path of the Python file to check
+        lexer (str): name of the lexer engine to check
+    Returns:
+        Tuple of path, time taken, status and difference found
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, 'r', encoding="utf-8") as file:
+            source = file.read()
+    except (OSError, UnicodeDecodeError) as err:
+        return path, 0.0, "cancelled", f"read failed: {err}"
+    problem = diff_lexers(source, "tokenize", lexer)
+    return path, time.perf_counter() - start, "mismatch" if problem else "ok", problem
+
+
+def find_python_files(root: str) -> List[str]:
+    """
+    Finds every Python file below the root directory, leaving
+    out installed third party packages
+
+    Args:
+        root (str): the directory to search
+    Returns:
+        Sorted list of file paths
+    """
+    paths = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = [name for name in dir_names if name not in ("site-packages", "__pycache__")]
+        paths.extend(os.path.join(dir_path, name) for name in file_names if name.endswith(".py"))
+    return sorted(paths)
+
+
+def run_corpus(
+        paths: List[str],
+        limits: RenderLimits,
+        workers: Optional[int] = None,
+        lexer: str = "tokenize",
+        diff: bool = False) -> Iterator[Tuple[str, float, str, Optional[str]]]:
+    """
+    Checks every file across a pool of worker processes
+
+    Args:
+        paths (List[str]): paths of the Python files to check
+        limits (RenderLimits): the limits to apply when rendering
+        workers (int): number of worker processes
+        lexer (str): name of the lexer engine to tokenize with
+        diff (bool): compare the token streams of the lexer and
+                     tokenize instead of rendering
+    Returns:
+        Iterator of check_file or diff_file results in the order of the paths
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if diff:
+            yield from executor.map(diff_file, paths, repeat(lexer), chunksize=16)
+        else:
+            yield from executor.map(check_file, paths, repeat(limits), repeat(lexer), chunksize=16)
+
+
+def print_report(results: List[Tuple[str, float, str, Optional[str]]], top: int) -> None:
+    """
+    Prints the slowest files and every failing file
+
+    Args:
+        results (List[Tuple]): results from check_file
+        top (int): number of slowest files to show
+    """
+    failing = [result for result in results if result[2] != "ok"]
+    total = sum(result[1] for result in results)
+    print(f"\n[+] Checked {len(results)} files in {total:.2f} s")
+    print(f"[+] {len(results) - len(failing)} passed, {len(failing)} failed")
+    print(f"\n[+] Slowest {top} files:")
+    for path, seconds, status, _ in sorted(results, key=lambda result: result[1], reverse=True)[:top]:
+        print(f"    {seconds * 1000:10.1f} ms  {status:<10} {path}")
+    if failing:
+        print("\n[-] Failing files, slowest first:")
+        for path, seconds, status, problem in sorted(failing, key=lambda result: result[1], reverse=True):
+            print(f"    {seconds * 1000:10.1f} ms  {status:<10} {path}\n{' ' * 18}{problem}")
+
+
+def main() -> None:
+    """
+    Main function for the corpus harness
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', nargs='?', default=sysconfig.get_paths()["stdlib"],
+                        help='Directory of Python files to check. Defaults to the standard library')
+    parser.add_argument('-n', '--top', type=int, default=20, help='Number of slowest files to show')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes')
+    parser.add_argument('-l', '--lexer', default='tokenize', choices=list(LEXERS), help='Lexer engine to use')
+    parser.add_argument('--diff-lexers', action='store_true',
+                        help='Compare the token stream of the lexer engine against tokenize instead of rendering')
+    parser.add_argument('--max-seconds', type=float, default=30.0, help='Render time limit per file')
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        parser.error('\n\n[-] Directory not found\n')
+    limits = RenderLimits(max_seconds=args.max_seconds, max_source_bytes=None, max_output_bytes=None)
+    paths = find_python_files(args.root)
+    results = list(run_corpus(paths, limits, args.workers, args.lexer, args.diff_lexers))
+    print_report(results, args.top)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+"""
+Lexer engine module. Defines the interface used to turn Python
+source code into the token stream read by the PythonParser,
+along with the available lexer engines
+"""
+
+from __future__ import annotations
+
+import io
+import re
+import token
+
+from collections import namedtuple
+
+# Only imported by type checkers so typing stays off the start
+# up path of the command line tool
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Iterator, List, Optional, Pattern, Tuple
+
+# A lightweight token holding only the fields the PythonParser
+# reads. Field names match tokenize.TokenInfo
+Lexeme = namedtuple("Lexeme", ["type", "string", "start", "end"])
+
+
+class LexerEngine:
+    """
+    Base class for lexer engines. An engine turns the full
+    source code of a file into a stream of tokens with the
+    type, string, start and end fields of tokenize.TokenInfo
+    """
+
+    name = ""
+
+    def tokens(self, source: str) -> Iterator:
+        """
+        Tokenizes Python source code
+
+        Args:
+            source (str): the Python source code
+        Returns:
+            Iterator of tokens
+        """
+        raise NotImplementedError
+
+
+class TokenizeLexer(LexerEngine):
+    """
+    Lexer engine built on the tokenize module from the
+    standard library
+    """
+
+    name = "tokenize"
+
+    def tokens(self, source: str) -> Iterator:
+        """
+        Tokenizes Python source code with tokenize.generate_tokens.
+        On Python 3.12 and later the FSTRING_START, FSTRING_MIDDLE
+        and FSTRING_END tokens of an f-string are merged back into
+        a single STRING token, as produced by earlier versions
+
+        Args:
+            source (str): the Python source code
+        Returns:
+            Iterator of tokenize.TokenInfo objects
+        """
+        import tokenize
+
+        tokens = tokenize.generate_tokens(io.StringIO(source).readline)
+        fstring_start = getattr(token, "FSTRING_START", None)
+        if fstring_start is None:
+            return tokens
+        return self.merge_fstrings(tokens, source)
+
+    @staticmethod
+    def merge_fstrings(tokens: Iterator, source: str) -> Iterator:
+        """
+        Merges the tokens making up each f-string into one
+        STRING token spanning the whole f-string
+
+        Args:
+            tokens (Iterator): tokens from tokenize.generate_tokens
+            source (str): the Python source code
+        Returns:
+            Iterator of tokens
+        """
+        line_offsets = [0]
+        for line in source.splitlines(keepends=True):
+            line_offsets.append(line_offsets[-1] + len(line))
+        depth = 0
+        start = None
+        for tok in tokens:
+            if tok.type == token.FSTRING_START:
+                if depth == 0:
+                    start = tok.start
+                depth += 1
+            elif tok.type == token.FSTRING_END:
+                depth -= 1
+                if depth == 0:
+                    first = line_offsets[start[0] - 1] + start[1]
+                    last = line_offsets[tok.end[0] - 1] + tok.end[1]
+                    yield Lexeme(token.STRING, source[first:last], start, tok.end)
+            elif depth == 0:
+                yield tok
+
+
+# Number patterns following the grammar used by tokenize
+_DIGITS = r'[0-9](?:_?[0-9])*'
+_EXPONENT = rf'[eE][-+]?{_DIGITS}'
+_POINT_FLOAT = rf'(?:{_DIGITS}\.(?:{_DIGITS})?|\.{_DIGITS})(?:{_EXPONENT})?'
+_FLOAT = rf'{_POINT_FLOAT}|{_DIGITS}{_EXPONENT}'
+_IMAG = rf'(?:{_FLOAT}|{_DIGITS})[jJ]'
+_INT = r'0[xX](?:_?[0-9a-fA-F])+|0[bB](?:_?[01])+|0[oO](?:_?[0-7])+|0(?:_?0)*|[1-9](?:_?[0-9])*'
+
+_STR_PREFIX = r'(?:[bB][rR]?|[rR][bBfF]?|[uU]|[fF][rR]?)?'
+
+_OPERATORS = [
+    "**=", "//=", ">>=", "<<=", "...", "->", ":=", "!=", "%=", "&=", "**", "*=", "+=", "-=", "//", "/=",
+    "<<", "<=", "==", ">=", ">>", "@=", "^=", "|=", "%", "&", "(", ")", "*", "+", ",", "-", ".", "/",
+    ":", ";", "<", "=", ">", "@", "[", "]", "^", "{", "|", "}", "~"
+]
+
+# Single pattern matching every lexeme in the source along with the
+# whitespace before it. The groups are tried in order and the last
+# group matches any character so the scanner never skips over part
+# of the buffer. Compiled on first use by get_scanner
+_SCANNER_PATTERN = (
+    r'[ \t\f]*(?:'
+    rf'(?P<string>{_STR_PREFIX}(?:'
+    r"'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"
+    r'|"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""'
+    r"|'(?!'')[^\n'\\]*(?:\\.[^\n'\\]*)*'"
+    r'|"(?!"")[^\n"\\]*(?:\\.[^\n"\\]*)*"))'
+    rf'|(?P<number>{_IMAG}|{_FLOAT}|{_INT})'
+    r'|(?P<name>\w+)'
+    rf'|(?P<op>{"|".join(re.escape(op) for op in _OPERATORS)})'
+    r'|(?P<newline>\r?\n)'
+    r'|(?P<comment>#[^\r\n]*)'
+    r'|(?P<cont>\\\r?\n)'
+    rf'|(?P<unterminated>{_STR_PREFIX}(?:\'\'\'|"""))'
+    r'|(?P<end>\Z)'
+    r'|(?P<error>.))'
+)
+_SCANNER = None
+
+# Token types looked up once rather than on every token
+COMMENT, DEDENT, ENDMARKER, ERRORTOKEN, INDENT, NAME, NEWLINE, NL, NUMBER, OP, STRING = (
+    token.COMMENT, token.DEDENT, token.ENDMARKER, token.ERRORTOKEN, token.INDENT, token.NAME,
+    token.NEWLINE, token.NL, token.NUMBER, token.OP, token.STRING
+)
+
+_OPEN_BRACKETS = frozenset("([{")
+_CLOSE_BRACKETS = frozenset(")]}")
+
+
+def get_scanner() -> Pattern:
+    """
+    Gets the compiled scanner pattern, compiling it the first
+    time it is needed
+
+    Returns:
+        The compiled scanner pattern
+    """
+    global _SCANNER
+    if _SCANNER is None:
+        _SCANNER = re.compile(_SCANNER_PATTERN, re.DOTALL)
+    return _SCANNER
+
+
+def indent_column(whitespace: str) -> int:
+    """
+    Gets the column an indented line starts at, with tabs
+    advancing to the next multiple of 8 as in tokenize
+
+    Args:
+        whitespace (str): the leading whitespace of the line
+    Returns:
+        The indentation column
+    """
+    column = 0
+    for char in whitespace:
+        if char == " ":
+            column += 1
+        elif char == "\t":
+            column = (column // 8 + 1) * 8
+        else:
+            column = 0
+    return column
+
+
+class RegexLexer(LexerEngine):
+    """
+    Lexer engine that scans the whole source buffer with a
+    single compiled regular expression and yields Lexeme tokens
+    instead of building a tokenize.TokenInfo with a copy of the
+    line for every token
+    """
+
+    name = "regex"
+
+    def tokens(self, source: str) -> Iterator[Lexeme]:
+        """
+        Tokenizes Python source code, producing the same token
+        types and positions as tokenize.generate_tokens
+
+        Args:
+            source (str): the Python source code
+        Returns:
+            Iterator of Lexeme tokens
+        Raises:
+            SyntaxError: if a bracket or multi-line string is left
+                         open at the end of the file
+            IndentationError: if a dedent does not match any outer
+                              indentation level
+        """
+        new = tuple.__new__
+        row = 1
+        line_start = 0
+        depth = 0
+        indents = [0]
+        at_line_start = True
+        line_has_code = False
+        line_has_comment = False
+
+        for match in get_scanner().finditer(source):
+            kind = match.lastgroup
+            start = match.start(kind)
+            end = match.end()
+            text = source[start:end]
+            column = start - line_start
+
+            if kind == "name":
+                if not at_line_start:
+                    line_has_code = True
+                    yield new(Lexeme, (NAME, text, (row, column), (row, column + end - start)))
+                    continue
+            elif kind == "op":
+                if not at_line_start:
+                    line_has_code = True
+                    if text in _OPEN_BRACKETS:
+                        depth += 1
+                    elif text in _CLOSE_BRACKETS and depth:
+                        depth -= 1
+                    yield new(Lexeme, (OP, text, (row, column), (row, column + end - start)))
+                    continue
+            elif kind == "newline":
+                if line_has_code and depth == 0:
+                    yield new(Lexeme, (NEWLINE, text, (row, column), (row, column + end - start)))
+                else:
+                    yield new(Lexeme, (NL, text, (row, column), (row, column + end - start)))
+                row += 1
+                line_start = end
+                at_line_start = depth == 0
+                line_has_code = False
+                line_has_comment = False
+                continue
+            elif kind == "comment":
+                line_has_comment = True
+                yield new(Lexeme, (COMMENT, text, (row, column), (row, column + end - start)))
+                continue
+            elif kind == "cont":
+                if end == len(source):
+                    raise SyntaxError("EOF in multi-line statement", ("<string>", row, column, None))
+                row += 1
+                line_start = end
+                continue
+            elif kind == "end":
+                continue
+            elif kind == "unterminated":
+                raise SyntaxError("EOF in multi-line string", ("<string>", row, column + 1, None))
+            elif kind == "error":
+                # tokenize reports each space before an unknown character
+                # as an error token of its own
+                first = match.start()
+                if not at_line_start:
+                    for offset in range(first, start):
+                        yield new(Lexeme, (ERRORTOKEN, source[offset], (row, offset - line_start),
+                                           (row, offset - line_start + 1)))
+
+            if at_line_start:
+                at_line_start = False
+                leading = source[line_start:start]
+                indent = indent_column(leading)
+                if indent > indents[-1]:
+                    indents.append(indent)
+                    yield new(Lexeme, (INDENT, leading, (row, 0), (row, column)))
+                while indent < indents[-1]:
+                    indents.pop()
+                    if indent > indents[-1]:
+                        raise IndentationError(
+                            "unindent does not match any outer indentation level",
+                            ("<string>", row, column, None))
+                    yield new(Lexeme, (DEDENT, "", (row, column), (row, column)))
+            line_has_code = True
+
+            if kind == "string":
+                newlines = text.count("\n")
+                if newlines:
+                    end_row = row + newlines
+                    end_column = len(text) - text.rindex("\n") - 1
+                    yield new(Lexeme, (STRING, text, (row, column), (end_row, end_column)))
+                    row = end_row
+                    line_start = end - end_column
+                else:
+                    yield new(Lexeme, (STRING, text, (row, column), (row, column + end - start)))
+            elif kind == "number":
+                yield new(Lexeme, (NUMBER, text, (row, column), (row, column + end - start)))
+            elif kind == "name":
+                yield new(Lexeme, (NAME, text, (row, column), (row, column + end - start)))
+            elif kind == "op":
+                if text in _OPEN_BRACKETS:
+                    depth += 1
+                elif text in _CLOSE_BRACKETS and depth:
+                    depth -= 1
+                yield new(Lexeme, (OP, text, (row, column), (row, column + end - start)))
+            else:
+                yield new(Lexeme, (ERRORTOKEN, text, (row, column), (row, column + 1)))
+
+        if depth:
+            raise SyntaxError("EOF in multi-line statement", ("<string>", row, 0, None))
+        column = len(source) - line_start
+        if line_has_code:
+            yield Lexeme(NEWLINE, "", (row, column), (row, column + 1))
+            row += 1
+        elif line_has_comment:
+            yield Lexeme(NL, "", (row, column), (row, column))
+            row += 1
+        for _ in indents[1:]:
+            yield Lexeme(DEDENT, "", (row, 0), (row, 0))
+        yield Lexeme(ENDMARKER, "", (row, 0), (row, 0))
+
+
+LEXERS = {
+    TokenizeLexer.name: TokenizeLexer,
+    RegexLexer.name: RegexLexer
+}
+
+
+def get_lexer(name: str = TokenizeLexer.name) -> LexerEngine:
+    """
+    Gets a lexer engine by name
+
+    Args:
+        name (str): name of the lexer engine
+    Returns:
+        An instance of the lexer engine
+    """
+    return LEXERS[name]()
+
+
+def token_stream(tokens: Iterator) -> List[Tuple]:
+    """
+    Gets the fields compared between lexer engines from
+    each token in a stream
+
+    Args:
+        tokens (Iterator): the tokens to read
+    Returns:
+        List of (type name, string, start, end) tuples
+    """
+    return [(token.tok_name[tok.type], tok.string, tok.start, tok.end) for tok in tokens]
+
+
+def diff_lexers(source: str, expected: str = "tokenize", actual: str = "regex") -> Optional[str]:
+    """
+    Compares the token streams two lexer engines produce for
+    the same source code
+
+    Args:
+        source (str): the Python source code
+        expected (str): name of the reference lexer engine
+        actual (str): name of the lexer engine being checked
+    Returns:
+        Description of the first difference, None if the streams match
+    """
+    results = []
+    for name in (expected, actual):
+        try:
+            results.append(token_stream(get_lexer(name).tokens(source)))
+        except SyntaxError as err:
+            results.append(f"{type(err).__name__}: {err.msg}")
+        except Exception as err:  # tokenize.TokenError
+            results.append(f"{type(err).__name__}: {err.args[0]}")
+    want, got = results
+    if isinstance(want, str) or isinstance(got, str):
+        if isinstance(want, str) and isinstance(got, str):
+            return None
+        return f"{expected}: {want if isinstance(want, str) else 'ok'}, {actual}: {got if isinstance(got, str) else 'ok'}"
+    for index, (want_token, got_token) in enumerate(zip(want, got)):
+        if want_token != got_token:
+            return f"token {index}: expected {want_token}, got {got_token}"
+    if len(want) != len(got):
+        return f"expected {len(want)} tokens, got {len(got)}"
+    return None
@@ -0,0 +1,324 @@
+#!/usr/bin/bash python
+
+"""
+Line store module. Keeps the rendered HTML of each source line
+in a SQLite database so any range of lines of a file can be
+fetched with an indexed query instead of re-rendering the file
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+from typing import Iterable, List, Optional, Tuple
+
+from source_parser import PythonParser
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        sha256 TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        line_count INTEGER NOT NULL,
+        theme TEXT NOT NULL,
+        lexer TEXT NOT NULL,
+        status TEXT NOT NULL,
+        reason TEXT,
+        rendered_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS lines (
+        file_id INTEGER NOT NULL REFERENCES files (id) ON DELETE CASCADE,
+        line_no INTEGER NOT NULL,
+        html TEXT NOT NULL,
+        PRIMARY KEY (file_id, line_no)
+    ) WITHOUT ROWID;
+"""
+
+# Code line elements in the HTML output. Token values are escaped
+# so a closing code tag can only end an element
+CODE_LINE = re.compile(r'<code class="code-line">.*?</code>', re.DOTALL)
+
+
+def code_lines(html: str) -> List[str]:
+    """
+    Splits a rendered HTML page into its code line elements
+
+    Args:
+        html (str): the HTML output string
+    Returns:
+        List of HTML fragments, one per line
+    """
+    return CODE_LINE.findall(html)
+
+
+def source_line_count(source: str) -> int:
+    """
+    Counts the lines of source code the way the tokenizer reads
+    them, split on newlines only
+
+    Args:
+        source (str): the Python source code
+    Returns:
+        The number of lines
+    """
+    return source.count("\n") + (1 if source and not source.endswith("\n") else 0)
+
+
+def plain_lines(path: str) -> List[str]:
+    """
+    Renders each line of a file as escaped text without syntax
+    highlighting, numbered the same way as the source
+
+    Args:
+        path (str): path of the file
+    Returns:
+        List of HTML fragments, one per line
+    """
+    with open(path, 'r', encoding="utf-8") as file:
+        lines = file.read().split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    python_parser = PythonParser(iter(()), len(lines), "")
+    python_parser.add_plain_lines(lines)
+    return code_lines(python_parser.html)
+
+
+def file_digest(path: str) -> Tuple[str, int]:
+    """
+    Gets the SHA-256 hash and size of a file
+
+    Args:
+        path (str): path of the file
+    Returns:
+        Tuple of the hex digest and the size in bytes
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    return hashlib.sha256(content).hexdigest(), len(content)
+
+
+class LineStore:
+    """
+    SQLite database of rendered source lines, keyed by the
+    absolute path of each file
+    """
+
+    def __init__(self, db_path: str) -> None:
+        """
+        Constructor for the LineStore class. Creates the database
+        and tables if they do not exist
+
+        Args:
+            db_path (str): path of the SQLite database file
+        """
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """
+        Closes the database connection
+        """
+        self.conn.close()
+
+    def changed_files(self, paths: Iterable[str], theme: str, lexer: str) -> List[Tuple[str, str, int]]:
+        """
+        Finds the files whose content differs from the version
+        in the store, that were stored with a different theme or
+        lexer engine, that were degraded or cancelled last time, or
+        that are not in the store yet
+
+        Args:
+            paths (Iterable[str]): paths of the files to check
+            theme (str): name of the theme to render with
+            lexer (str): name of the lexer engine to render with
+        Returns:
+            List of (absolute path, digest, size) for changed files.
+            Files that cannot be read have a digest of None
+        """
+        changed = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                digest, size = file_digest(path)
+            except OSError:
+                changed.append((path, None, 0))
+                continue
+            row = self.conn.execute(
+                "SELECT sha256, theme, lexer, status FROM files WHERE path = ?", (path,)).fetchone()
+            if row != (digest, theme, lexer, "ok"):
+                changed.append((path, digest, size))
+        return changed
+
+    def remove_file(self, path: str) -> None:
+        """
+        Removes a file and its lines from the store
+
+        Args:
+            path (str): absolute path of the file
+        """
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def remove_missing(self) -> int:
+        """
+        Removes every file that no longer exists from the store, so
+        its lines are not served after it was deleted
+
+        Returns:
+            Number of files removed
+        """
+        paths = [path for path, in self.conn.execute("SELECT path FROM files") if not os.path.isfile(path)]
+        with self.conn:
+            for path in paths:
+                self.remove_file(path)
+        return len(paths)
+
+    def replace_file(
+            self,
+            path: str,
+            digest: str,
+            size: int,
+            lines: List[str],
+            theme: str,
+            lexer: str,
+            status: str = "ok",
+            reason: Optional[str] = None) -> None:
+        """
+        Replaces the stored lines of a file. Must be called inside
+        a transaction so readers never see a partly written file
+
+        Args:
+            path (str): absolute path of the file
+            digest (str): SHA-256 hex digest of the file content
+            size (int): size of the file in bytes
+            lines (List[str]): HTML fragment for each line
+            theme (str): name of the theme the lines were rendered for
+            lexer (str): name of the lexer engine used
+            status (str): render status of the file
+            reason (str): why the file was degraded or cancelled
+        """
+        values = (digest, size, len(lines), theme, lexer, status, reason, time.time())
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            cursor = self.conn.execute(
+                "INSERT INTO files (sha256, size, line_count, theme, lexer, status, reason, rendered_at, path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*values, path))
+            file_id = cursor.lastrowid
+        else:
+            file_id = row[0]
+            self.conn.execute(
+                "UPDATE files SET sha256 = ?, size = ?, line_count = ?, theme = ?, lexer = ?, "
+                "status = ?, reason = ?, rendered_at = ? WHERE id = ?",
+                (*values, file_id))
+            self.conn.execute("DELETE FROM lines WHERE file_id = ?", (file_id,))
+        self.conn.executemany(
+            "INSERT INTO lines (file_id, line_no, html) VALUES (?, ?, ?)",
+            ((file_id, number, html) for number, html in enumerate(lines, start=1)))
+
+    def write_results(
+            self,
+            results: Iterable[Tuple[Tuple[str, str, int], object]],
+            theme: str,
+            lexer: str,
+            batch_size: int = 100) -> int:
+        """
+        Writes rendered files to the store, committing one
+        transaction per batch of files. Files that could not be
+        read are removed from the store. When the rendered lines do not line up
+        with the source lines, plain text lines are stored instead
+        and the file is marked as degraded, so a range of lines
+        always holds the source lines asked for
+
+        Args:
+            results (Iterable[Tuple]): pairs of (path, digest, size)
+                                       and the RenderResult for the file
+            theme (str): name of the theme the files were rendered for
+            lexer (str): name of the lexer engine used
+            batch_size (int): number of files per transaction
+        Returns:
+            Number of files written
+        """
+        written = 0
+        pending = []
+        for (path, digest, size), result in results:
+            if digest is None:
+                with self.conn:
+                    self.remove_file(path)
+                continue
+            status, reason = result.status, result.reason
+            lines = code_lines(result.html) if result.html is not None else []
+            if result.html is not None and len(lines) != result.line_count:
+                reason = f"rendered {len(lines)} lines for {result.line_count} source lines"
+                try:
+                    lines, status = plain_lines(path), "degraded"
+                except (OSError, UnicodeDecodeError) as err:
+                    lines, status, reason = [], "cancelled", f"{reason}, read failed: {err}"
+            pending.append((path, digest, size, lines, theme, lexer, status, reason))
+            if len(pending) >= batch_size:
+                written += self.flush(pending)
+        return written + self.flush(pending)
+
+    def flush(self, pending: List[Tuple]) -> int:
+        """
+        Writes the pending files in a single transaction and
+        clears the list
+
+        Args:
+            pending (List[Tuple]): arguments for replace_file
+        Returns:
+            Number of files written
+        """
+        count = len(pending)
+        with self.conn:
+            for args in pending:
+                self.replace_file(*args)
+        pending.clear()
+        return count
+
+    def fetch_lines(self, path: str, start: int, end: int) -> List[Tuple[int, str]]:
+        """
+        Gets a range of rendered lines of a file
+
+        Args:
+            path (str): path of the file
+            start (int): first line number, starting at 1
+            end (int): last line number, inclusive
+        Returns:
+            List of (line number, HTML fragment) tuples
+        """
+        return self.conn.execute(
+            "SELECT lines.line_no, lines.html FROM lines JOIN files ON files.id = lines.file_id "
+            "WHERE files.path = ? AND lines.line_no BETWEEN ? AND ? ORDER BY lines.line_no",
+            (os.path.abspath(path), start, end)).fetchall()
+
+
+def main() -> None:
+    """
+    Main function for the line store. Prints a range of
+    rendered lines of a file from the database
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('db', help='Path of the SQLite database')
+    parser.add_argument('path', help='Path of the source file')
+    parser.add_argument('start', type=int, help='First line number')
+    parser.add_argument('end', type=int, help='Last line number')
+    args = parser.parse_args()
+    if not os.path.isfile(args.db):
+        parser.error('\n\n[-] Database not found\n')
+    store = LineStore(args.db)
+    try:
+        for _, html in store.fetch_lines(args.path, args.start, args.end):
+            print(html)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
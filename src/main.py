@@ -2,12 +2,9 @@
 
 import argparse
 import os
-import pathlib
-import platform
 import sys
-import themes
-import tokenize
 
+from lexers import LEXERS, get_lexer
 from source_parser import PythonParser
 from vars import theme_list
 
@@ -17,13 +14,9 @@ def get_theme(theme) -> str:
     Get the theme from themes.py based on argument
     passed in by the user for --theme
     """
-    theme_dict = {
-        "cool_blue_light": themes.COOL_BLUE_LIGHT,
-        "cyber": themes.CYBER,
-        "robot": themes.ROBOT,
-        "robot_light": themes.ROBOT_LIGHT
-    }
-    return theme_dict[theme]
+    import themes
+
+    return getattr(themes, theme.upper())
 
 
 def get_args() -> argparse.Namespace:
@@ -39,17 +32,42 @@ def get_args() -> argparse.Namespace:
         help='The full path of the Python file to be parsed into HTML')
     parser.add_argument('-t', '--theme', dest='theme', help='Syntax highlighting theme to use. Defaults to COOL_BLUE')
     parser.add_argument('-o', '--output', action='store_true', help='Send the output to a file')
+    parser.add_argument(
+        '-l',
+        '--lexer',
+        default='tokenize',
+        choices=list(LEXERS),
+        help='Lexer engine used to tokenize the source. Defaults to tokenize')
+    parser.add_argument(
+        '--themes',
+        nargs='+',
+        metavar='THEME',
+        help='Render once with every theme listed, or "all", switchable in the browser')
+    parser.add_argument(
+        '-f',
+        '--format',
+        default='spans',
+        choices=['spans', 'runs'],
+        help='Output format. "runs" sends the source once with class runs painted by a script. Defaults to spans')
     args = parser.parse_args()
     if not args.path:
         parser.error('\n\n[-] Expected a file to parse\n')
     if not os.path.isfile(args.path):
         parser.error('\n\n[-] File not found\n')
-    suffix = pathlib.Path(args.path).suffix
+    suffix = os.path.splitext(args.path)[1]
     if not suffix == '.py':
         parser.error(f'\n\n[-] Expected a Python (.py) file, not {suffix} file type\n')
     theme = args.theme
     if theme and theme.lower() not in theme_list:
         parser.error(f"\n\n[-] Unknown theme: {theme}. See https://github.com/sedexdev/source_page for more\n")
+    if args.themes and args.format == 'runs':
+        parser.error('\n\n[-] --themes is not supported with the runs format\n')
+    if args.themes:
+        if [name.lower() for name in args.themes] == ["all"]:
+            args.themes = list(theme_list)
+        for name in args.themes:
+            if name.lower() not in theme_list:
+                parser.error(f"\n\n[-] Unknown theme: {name}. See https://github.com/sedexdev/source_page for more\n")
     return args
 
 
@@ -66,8 +84,7 @@ def check_py_version(major: int, minor: int) -> bool:
         Boolean stating whether the Python version meets
         the values in the parameters
     """
-    version = platform.python_version_tuple()
-    return int(version[0]) >= major and int(version[1]) >= minor
+    return sys.version_info[:2] >= (major, minor)
 
 
 def get_source_path(path: str) -> str:
@@ -91,9 +108,9 @@ def pretty_html(html: str) -> str:
         html (str): the HTML output string
     """
     format_html = html
-    format_html = format_html.replace("<code", f"\n{" " * 12}<code")
-    format_html = format_html.replace("<span", f"\n{" " * 16}<span")
-    format_html = format_html.replace("</code>", f"\n{" " * 12}</code>\n")
+    format_html = format_html.replace("<code", f"\n{' ' * 12}<code")
+    format_html = format_html.replace("<span", f"\n{' ' * 16}<span")
+    format_html = format_html.replace("</code>", f"\n{' ' * 12}</code>\n")
     return format_html
 
 
@@ -127,27 +144,41 @@ def main() -> None:
     write a HTML string that can be sent to stdout
     or written directly to a .html file
     """
-    if not check_py_version(3, 6):
-        print("\n[-] This program requires Python3.6 or later!")
+    if not check_py_version(3, 7):
+        print("\n[-] This program requires Python3.7 or later!")
         print("[-] Please upgrade now!\n")
         sys.exit(1)
     args = get_args()
     full_path = get_source_path(args.path)
     try:
         with open(full_path, 'r', encoding="utf-8") as file:
-            lines = file.readlines()
-        with open(full_path, 'r', encoding="utf-8") as file:
-            tokens = tokenize.generate_tokens(file.readline)
-            if args.theme:
-                theme = get_theme(args.theme.lower())
-                python_parser = PythonParser(tokens, len(lines), theme)
-            else:
-                python_parser = PythonParser(tokens, len(lines))
-            html = python_parser.generate_html()
+            source = file.read()
+        if args.format == 'runs':
+            from payload import generate_runs_html
+
+            theme = get_theme(args.theme.lower()) if args.theme else None
+            html = generate_runs_html(source, theme, args.lexer)
             if not args.output:
-                print(pretty_html(html))
+                print(html)
             else:
                 write_html_file(html, sys.platform)
+            return
+        lines = source.splitlines()
+        tokens = get_lexer(args.lexer).tokens(source)
+        if args.theme:
+            theme = get_theme(args.theme.lower())
+            python_parser = PythonParser(tokens, len(lines), theme)
+        else:
+            python_parser = PythonParser(tokens, len(lines))
+        if args.themes:
+            html = python_parser.generate_multi_theme_html(
+                {name.lower(): get_theme(name.lower()) for name in args.themes})
+        else:
+            html = python_parser.generate_html()
+        if not args.output:
+            print(pretty_html(html))
+        else:
+            write_html_file(html, sys.platform)
     except FileNotFoundError:
         print("\n[-] File not found")
 
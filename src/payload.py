@@ -0,0 +1,205 @@
+"""
+Token run payload module. Builds a compact alternative to the
+span based HTML output: the escaped source is sent once along
+with a run length encoded list of CSS class IDs and lengths,
+and a small script paints the spans in the browser
+"""
+
+from __future__ import annotations
+
+import json
+
+from lexers import get_lexer
+from source_parser import escape_html, get_name_class, get_span_class
+from vars import token_map
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+# CSS classes from themes.py, indexed by the class IDs in the runs.
+# ID 0 is text outside any token that is left unstyled
+RUN_CLASSES = [
+    "",
+    "python-txt",
+    "python-op",
+    "python-str",
+    "python-str-prefix",
+    "python-keyword",
+    "python-special-keyword",
+    "python-comment",
+    "python-func",
+    "python-class"
+]
+
+_CLASS_IDS = {name: index for index, name in enumerate(RUN_CLASSES)}
+
+# Tokens that only mark structure and have no text of their own to style
+_STRUCTURAL = frozenset(["NEWLINE", "NL", "INDENT", "DEDENT", "ENDMARKER"])
+
+# Splits the text of the pre element into runs and wraps each styled run
+# in a span, then fills the line number gutter
+PAINT_SCRIPT = (
+    "(function(){"
+    "var d=document,p=d.getElementById('source-runs'),g=d.getElementById('source-gutter'),"
+    "c=JSON.parse(d.getElementById('source-classes').textContent),"
+    "r=JSON.parse(d.getElementById('source-data').textContent),"
+    "t=p.textContent,f=d.createDocumentFragment(),o=0,i,s,e,n=[];"
+    "for(i=0;i<r.length;i+=2){s=t.substr(o,r[i+1]);o+=r[i+1];"
+    "if(r[i]){e=d.createElement('span');e.className=c[r[i]];e.textContent=s;f.appendChild(e)}"
+    "else f.appendChild(d.createTextNode(s))}"
+    "if(o<t.length)f.appendChild(d.createTextNode(t.substr(o)));"
+    "p.textContent='';p.appendChild(f);"
+    "for(i=1;i<=t.replace(/\\n$/,'').split('\\n').length;i++)n.push(i+'.');"
+    "g.textContent=n.join('\\n')"
+    "})();"
+)
+
+RUNS_STYLE = """
+    .source-runs-block {
+        display: flex;
+        flex-direction: row;
+    }
+    .source-runs-block pre {
+        margin: 0;
+        font-size: 1.1rem;
+        white-space: pre;
+    }
+    .source-runs-block .line-number {
+        padding-right: 1ch;
+        text-align: right;
+    }
+    """
+
+
+def text_length(text: str) -> int:
+    """
+    Gets the length of text as counted by JavaScript, in UTF-16
+    code units, so the runs line up with the text in the browser
+
+    Args:
+        text (str): the text to measure
+    Returns:
+        The number of UTF-16 code units
+    """
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le")) // 2
+
+
+def classify_runs(source: str, lexer: str = "tokenize", semantic: bool = True) -> List[int]:
+    """
+    Classifies the source code with the same rules as the span
+    based output and run length encodes the result. Whitespace
+    between tokens joins the run before it, as it looks the same
+    in any colour, so neighbouring tokens of one class merge
+
+    Args:
+        source (str): the Python source code, with \\n line endings
+        lexer (str): name of the lexer engine to tokenize with
+        semantic (bool): highlight function and class names
+    Returns:
+        Flat list of class ID and length pairs
+    """
+    line_offsets = [0]
+    for line in source.split("\n"):
+        line_offsets.append(line_offsets[-1] + len(line) + 1)
+
+    # Names are classified from their neighbours in the full token
+    # stream, as parse does, so a name at the end of a line is never
+    # taken for a call by the first token of the next line
+    tokens = list(get_lexer(lexer).tokens(source))
+    spans = []
+    for index, token in enumerate(tokens):
+        token_type = token_map[token.type]
+        if token_type in _STRUCTURAL or not token.string:
+            continue
+        span_class, prefixed = get_span_class(token)
+        if semantic and span_class == "python-txt" and token_type == "NAME":
+            prev_token = tokens[index - 1] if index else None
+            prev_value = "" if prev_token is None or token_map[prev_token.type] in _STRUCTURAL else prev_token.string
+            next_value = tokens[index + 1].string if index + 1 < len(tokens) else ""
+            span_class = get_name_class(prev_value, next_value)
+        start = line_offsets[token.start[0] - 1] + token.start[1]
+        end = line_offsets[token.end[0] - 1] + token.end[1]
+        spans.append((span_class, start, end, token.string, prefixed))
+
+    runs = []
+    cursor = 0
+    for span_class, start, end, value, prefixed in spans:
+        if start < cursor:
+            continue
+        gap = text_length(source[cursor:start])
+        if gap:
+            if runs:
+                runs[-1] += gap
+            else:
+                runs += [0, gap]
+        if prefixed:
+            append_run(runs, _CLASS_IDS["python-str-prefix"], text_length(value[0]))
+            append_run(runs, _CLASS_IDS[span_class], text_length(source[start + 1:end]))
+        else:
+            append_run(runs, _CLASS_IDS[span_class], text_length(source[start:end]))
+        cursor = end
+    return runs
+
+
+def append_run(runs: List[int], class_id: int, length: int) -> None:
+    """
+    Adds a run to the list, extending the last run when it has
+    the same class
+
+    Args:
+        runs (List[int]): flat list of class ID and length pairs
+        class_id (int): index of the CSS class in RUN_CLASSES
+        length (int): length of the run in UTF-16 code units
+    """
+    if runs and runs[-2] == class_id:
+        runs[-1] += length
+    elif length:
+        runs += [class_id, length]
+
+
+def generate_runs_html(source: str, theme: Optional[str] = None, lexer: str = "tokenize") -> str:
+    """
+    Generates a HTML page holding the escaped source code, the
+    token runs and the script that paints them
+
+    Args:
+        source (str): the Python source code
+        theme (str): colour scheme for syntax highlighting,
+                     COOL_BLUE when not given
+        lexer (str): name of the lexer engine to tokenize with
+    Returns:
+        The HTML page
+    """
+    if theme is None:
+        from themes import COOL_BLUE
+        theme = COOL_BLUE
+    # The browser turns \r\n into \n inside the page, so the runs
+    # are measured against the same text
+    source = source.replace("\r\n", "\n").replace("\r", "\n")
+    runs = json.dumps(classify_runs(source, lexer), separators=(",", ":"))
+    classes = json.dumps(RUN_CLASSES, separators=(",", ":"))
+    # A newline straight after <pre> is dropped by the HTML parser, so
+    # one is always added to keep a leading blank line in the source
+    return ("<!DOCTYPE html>\n"
+            "<html lang='en'>\n"
+            "    <head>\n"
+            "    <meta charset='UTF-8'>\n"
+            "    <meta name='viewport' content='width=device-width, initial-scale=1.0'>\n"
+            "    <title>SourcePage Output HTML</title>\n"
+            "    <style>\n"
+            f"{theme}\n"
+            f"{RUNS_STYLE}\n"
+            "    </style>\n"
+            "    </head>\n"
+            "    <body>\n"
+            "        <div class='code-block python-code-block source-runs-block'>"
+            "<pre id='source-gutter' class='line-number'></pre>"
+            f"<pre id='source-runs'>\n{escape_html(source)}</pre></div>\n"
+            f"        <script type='application/json' id='source-classes'>{classes}</script>\n"
+            f"        <script type='application/json' id='source-data'>{runs}</script>\n"
+            f"        <script>{PAINT_SCRIPT}</script>\n"
+            "    </body>\n"
+            "</html>")
@@ -2,9 +2,10 @@
 Python parser module
 """
 
-from themes import COOL_BLUE
-from tokenize import TokenInfo
-from typing import Iterator, Tuple
+from __future__ import annotations
+
+import re
+import time
 
 from vars import (
     keywords,
@@ -12,6 +13,36 @@ from vars import (
     token_map
 )
 
+# Only imported by type checkers so tokenize and typing stay
+# off the start up path of the command line tool
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from tokenize import TokenInfo
+    from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def escape_html(value: str) -> str:
+    """
+    Escapes the HTML special characters in a token value. Most
+    tokens contain none of them, so those are returned as they
+    are without building a new string. Chained replace calls are
+    used as str.translate with a mapping table is several times
+    slower on CPython
+
+    Args:
+        value (str): the token value to escape
+    Returns:
+        The token value safe to add to an HTML element
+    """
+    if "&" in value or "<" in value or ">" in value:
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return value
+
+
+# Escaped form of the operators that contain HTML special characters,
+# looked up directly as operators are the most common escaped tokens
+OP_ESCAPES = {op: escape_html(op) for op in ("<", ">", "<=", ">=", "<<", ">>", "<<=", ">>=", "&", "&=", "->", "<>")}
+
 
 def has_str_prefix(value: str) -> bool:
     """
@@ -41,6 +72,41 @@ def is_multi_line(value: str) -> bool:
     return value.startswith("\"\"\"") or value.startswith("'''")
 
 
+# A rule in one of the theme stylesheets: the selectors and the declarations.
+# Compiled by the re module cache the first time a theme is scoped
+CSS_RULE = r'([^{}]+)\{([^{}]*)\}'
+
+
+def theme_class(name: str) -> str:
+    """
+    Gets the CSS class used to scope a theme
+
+    Args:
+        name (str): name of the theme, e.g. cool_blue
+    Returns:
+        The class name, e.g. theme-cool-blue
+    """
+    return f"theme-{name.lower().replace('_', '-')}"
+
+
+def scope_theme(css: str, scope: str) -> str:
+    """
+    Prefixes every selector in a theme stylesheet with a root
+    class so several themes can be on the same page
+
+    Args:
+        css (str): the theme stylesheet from themes.py
+        scope (str): the root class to scope the theme under
+    Returns:
+        The scoped stylesheet
+    """
+    def scope_rule(rule: re.Match) -> str:
+        selectors = [selector.strip() for selector in rule.group(1).split(",")]
+        scoped = ",\n    ".join(f".{scope} {selector}" for selector in selectors)
+        return f"\n    {scoped} {{{rule.group(2)}}}"
+    return re.sub(CSS_RULE, scope_rule, css)
+
+
 def get_span_class(token: TokenInfo) -> Tuple:
     """
     Allocates the correct CSS class to an HTML span element
@@ -65,6 +131,33 @@ def get_span_class(token: TokenInfo) -> Tuple:
     return "python-txt", None
 
 
+def get_name_class(prev_value: str, next_value: str) -> str:
+    """
+    Allocates the CSS class for a name that is not a keyword
+    from the tokens either side of it
+
+    Args:
+        prev_value (str): value of the previous token
+        next_value (str): value of the next token
+    Returns:
+        The CSS class for the name
+    """
+    if prev_value == "def":
+        return "python-func"
+    if prev_value == "class":
+        return "python-class"
+    if next_value == "(":
+        return "python-func"
+    return "python-txt"
+
+
+class RenderBudgetExceeded(Exception):
+    """
+    Raised when rendering a file goes over one of the
+    limits set on the PythonParser
+    """
+
+
 class PythonParser:
     """
     Defines functions for parsing tokenized Python
@@ -72,7 +165,15 @@ class PythonParser:
     from the result
     """
 
-    def __init__(self, tokens: Iterator, file_length: int, theme=COOL_BLUE) -> None:
+    def __init__(
+            self,
+            tokens: Iterator,
+            file_length: int,
+            theme: Optional[str] = None,
+            deadline: Optional[float] = None,
+            max_output: Optional[int] = None,
+            semantic: bool = True,
+            escape: bool = True) -> None:
         """
         Constructor for the PythonParser class
 
@@ -81,14 +182,63 @@ class PythonParser:
             is_updated (bool): states if Python version is using
                                an updated token ID dictionary
             file_length (int): number of lines in the file
-            theme (str): colour scheme for syntax highlighting
+            theme (str): colour scheme for syntax highlighting,
+                         COOL_BLUE when not given
+            deadline (float): time.monotonic() value after which
+                              parsing is abandoned
+            max_output (int): maximum length of the HTML string
+            semantic (bool): highlight function and class names
+                             found from the surrounding tokens
+            escape (bool): escape HTML special characters in token
+                           values, only turned off to benchmark it
         """
         self.tokens = tokens
         self.file_length = file_length
+        if theme is None:
+            from themes import COOL_BLUE
+            theme = COOL_BLUE
         self.theme = theme
+        self.deadline = deadline
+        self.max_output = max_output
+        self.semantic = semantic
+        self.escape_value = escape_html if escape else str
+        self.op_escapes = OP_ESCAPES if escape else {}
+        self.theme_names = []
         self.html = ""
         self.line_number = 1
 
+    @property
+    def html(self) -> str:
+        """
+        The HTML built so far. Pieces are kept in a list as they are
+        added and joined when read, as adding to one long string
+        copies all of it every time
+        """
+        if len(self.html_parts) != 1:
+            self.html_parts = ["".join(self.html_parts)]
+        return self.html_parts[0]
+
+    @html.setter
+    def html(self, value: str) -> None:
+        """
+        Replaces the HTML built so far
+
+        Args:
+            value (str): the new HTML string
+        """
+        self.html_parts = [value]
+        self.html_size = len(value)
+
+    def add_html(self, value: str) -> None:
+        """
+        Adds a piece of HTML to the end of the output
+
+        Args:
+            value (str): the HTML to add
+        """
+        self.html_parts.append(value)
+        self.html_size += len(value)
+
     def add_line_helper(self, max_lines: int) -> None:
         """
         Adds the line number in a span element
@@ -96,10 +246,22 @@ class PythonParser:
         Args:
             max_lines (int): maximum number of lines
         """
+        self.add_html(self.line_number_html(max_lines))
+
+    def line_number_html(self, max_lines: int) -> str:
+        """
+        Gets the span element for the current line number, padded
+        to the width of the largest line number
+
+        Args:
+            max_lines (int): maximum number of lines
+        Returns:
+            The line number span element
+        """
         max_lines_len = len(str(max_lines))
         line_num_len = len(str(self.line_number))
         spacer = "&nbsp;" * (max_lines_len - line_num_len)
-        self.html += f"<span class='line-number'>{spacer}{self.line_number}.&nbsp;</span>"
+        return f"<span class='line-number'>{spacer}{self.line_number}.&nbsp;</span>"
 
     def add_line_number(self) -> None:
         """
@@ -107,16 +269,25 @@ class PythonParser:
         function with the appropriate parameters for
         a file with self.file_length many lines
         """
+        self.add_line_helper(self.max_lines())
+
+    def max_lines(self) -> int:
+        """
+        Gets the largest line number the line number gutter is
+        padded for, based on self.file_length
+
+        Returns:
+            The largest line number of the gutter width
+        """
         if self.file_length < 10:
-            self.add_line_helper(9)
-        elif self.file_length < 100:
-            self.add_line_helper(99)
-        elif self.file_length < 1000:
-            self.add_line_helper(999)
-        elif self.file_length < 10000:
-            self.add_line_helper(9999)
-        else:
-            self.add_line_helper(99999)
+            return 9
+        if self.file_length < 100:
+            return 99
+        if self.file_length < 1000:
+            return 999
+        if self.file_length < 10000:
+            return 9999
+        return 99999
 
     def delete_line(self) -> None:
         """
@@ -126,66 +297,75 @@ class PythonParser:
         string to be added on separate lines, as it appears
         in the Python source code
         """
-        last_code_line = self.html.rfind("<c")
-        self.html = self.html[:last_code_line]
+        html = self.html
+        self.html = html[:html.rfind("<c")]
 
-    def handle_multi_line_str(self, value: str, spacer: str, inline=False) -> None:
+    def handle_multi_line_str(self, value: str, spacer: str, inline=False) -> Iterator[int]:
         """
         Create a series of code blocks representing a multi-line
-        string in the source code with preserved indentation
+        string in the source code with preserved indentation. The
+        budget is checked and parsing pauses every 128 lines, like
+        parse_steps does between logical lines
 
         Args:
             value (str): The string value to process
             spacer (str): amount of whitespace to add
             inline (bool): states that this string is inline with
                            other code on the same line
+        Returns:
+            Iterator of the current line number at each step
         """
         first = True
-        string_split = value.split("\n")
-        for s in string_split:
+        max_lines = self.max_lines()
+        for index, s in enumerate(value.split("\n"), start=1):
             if first and not inline:
                 total_spacer = spacer
                 first = False
             else:
                 whitespace = len(s) - (len(s.lstrip(" ")))
                 total_spacer = "&nbsp;" * (whitespace - 1)
-            self.html += "<code class=\"code-line\">"
-            self.add_line_number()
-            self.html += f"<span class=\"python-str\">{total_spacer}{s}</span>"
-            self.html += "</code>"
+            self.add_html(f"<code class=\"code-line\">{self.line_number_html(max_lines)}"
+                          f"<span class=\"python-str\">{total_spacer}{self.escape_value(s)}</span></code>")
             self.line_number += 1
+            if index % 128 == 0:
+                self.check_budget()
+                yield self.line_number
 
-    def handle_string(self, value: str, prev_value: str, prefixed: bool, spacer: str) -> bool:
+    def handle_string(self, value: str, prev_value: str, prefixed: bool, spacer: str) -> Iterator[int]:
         """
         Adds a string token to the HTML file by checking to
         see if the string has a prefix, is a multi-line string,
-        or is just a regular string
+        or is just a regular string. Multi-line strings pause at
+        the steps of handle_multi_line_str
 
         Args:
             value (str): token string value
             prev_value (str): value of the previous token
             prefixed (bool): states whether the string is prefixed
             spacer (str): amount of whitespace to add
+        Returns:
+            Iterator of the current line number at each step, which
+            returns whether the string was a multi-line string
         """
         if prefixed:
-            self.html += f"<span class=\"python-str-prefix\">{spacer}{value[0]}</span>"
+            self.add_html(f"<span class=\"python-str-prefix\">{spacer}{value[0]}</span>")
             value = value[1:]
         if is_multi_line(value):
             if prev_value == "=":
                 first_str = value.split("\n")[0]
-                self.html += f"<span class=\"python-str\">{spacer}{first_str}</span>"
-                self.html += "</code>\n"
+                self.add_html(f"<span class=\"python-str\">{spacer}{self.escape_value(first_str)}</span>")
+                self.add_html("</code>\n")
                 self.line_number += 1
-                self.handle_multi_line_str(value[len(first_str) + 1:], spacer, True)
+                yield from self.handle_multi_line_str(value[len(first_str) + 1:], spacer, True)
                 return True
             self.delete_line()
-            self.handle_multi_line_str(value, spacer)
+            yield from self.handle_multi_line_str(value, spacer)
             return True
         else:
             if prefixed:
-                self.html += f"<span class=\"python-str\">{value}</span>"
+                self.add_html(f"<span class=\"python-str\">{self.escape_value(value)}</span>")
             else:
-                self.html += f"<span class=\"python-str\">{spacer}{value}</span>"
+                self.add_html(f"<span class=\"python-str\">{spacer}{self.escape_value(value)}</span>")
             return False
 
     def handle_comment(self, start: int, value: str) -> None:
@@ -197,11 +377,11 @@ class PythonParser:
             start (int): starting column of comment
             value (str): string value of the token
         """
-        self.html += "<code class=\"code-line\">"
+        self.add_html("<code class=\"code-line\">")
         self.add_line_number()
         spacer = "&nbsp;" * start
-        self.html += f"<span class=\"python-comment\">{spacer}{value}</span>"
-        self.html += "</code>"
+        self.add_html(f"<span class=\"python-comment\">{spacer}{self.escape_value(value)}</span>")
+        self.add_html("</code>")
         self.line_number += 1
 
     def handle_nl(self) -> None:
@@ -209,24 +389,54 @@ class PythonParser:
         Create an empty code block with a line number when a blank
         line needs to be inserted
         """
-        self.html += "<code class=\"code-line\">"
+        self.add_html("<code class=\"code-line\">")
         self.add_line_number()
-        self.html += "</code>"
+        self.add_html("</code>")
         self.line_number += 1
 
+    def check_budget(self) -> None:
+        """
+        Checks that the deadline and maximum output length set
+        for this parser have not been exceeded
+
+        Raises:
+            RenderBudgetExceeded: if either limit has been exceeded
+        """
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise RenderBudgetExceeded("render time limit exceeded")
+        if self.max_output is not None and self.html_size > self.max_output:
+            raise RenderBudgetExceeded("output size limit exceeded")
+
     def parse(self) -> None:
         """
         Parses the Python source code one token at a time, creating
         HTML elements of each line and writing the result to the
         output file.
         """
+        for _ in self.parse_steps():
+            pass
+
+    def parse_steps(self) -> Iterator[int]:
+        """
+        Parses the Python source code like parse, pausing at every
+        budget check: once per logical line, every 1024 tokens of a
+        long line and every 128 lines of a multi-line string.
+        Callers can do other work between steps or stop parsing by
+        closing the generator
+
+        Returns:
+            Iterator of the current line number at each step
+        """
         prev_token_was_multi_line = False
 
         while True:
 
+            self.check_budget()
+            yield self.line_number
+
             token = next(self.tokens, None)
 
-            if not token or token.type == "ENDMARKER":
+            if not token or token_map[token.type] == "ENDMARKER":
                 break
 
             token_type = token_map[token.type]
@@ -243,7 +453,6 @@ class PythonParser:
                 continue
 
             if token_type == "COMMENT":
-                print("FOUND COMMENT")
                 self.handle_comment(token_start, token_value)
                 next(self.tokens, None)
                 continue
@@ -255,16 +464,27 @@ class PythonParser:
             if token_type == "INDENT" or token_type == "DEDENT":
                 continue
 
-            self.html += "<code class=\"code-line\">"
+            self.add_html("<code class=\"code-line\">")
             self.add_line_number()
             first = True
 
             line_join = False
+            line_tokens = 0
+            pending_name = None
 
             while token_type != "NEWLINE":
 
+                # Long logical lines are checked as they go so a single
+                # pathological line cannot run past the limits
+                line_tokens += 1
+                if line_tokens % 1024 == 0:
+                    self.check_budget()
+                    yield self.line_number
+
                 if line_join:
-                    self.html += "<code class=\"code-line\">"
+                    self.check_budget()
+                    yield self.line_number
+                    self.add_html("<code class=\"code-line\">")
                     self.add_line_number()
                     first = True
 
@@ -280,13 +500,26 @@ class PythonParser:
                 span_class, prefixed = get_span_class(token)
 
                 if token_type == "STRING":
-                    break_parse = self.handle_string(token_value, prev_token_value, prefixed, spacer)
+                    break_parse = yield from self.handle_string(token_value, prev_token_value, prefixed, spacer)
                     if break_parse:
                         parse_broken = True
                         prev_token_was_multi_line = True
                         break
                 elif not prefixed:
-                    self.html += f"<span class=\"{span_class}\">{spacer}{token_value}</span>"
+                    if token_type == "NAME" or token_type == "NUMBER":
+                        html_value = token_value
+                    elif token_type == "OP":
+                        html_value = self.op_escapes.get(token_value, token_value)
+                    else:
+                        html_value = self.escape_value(token_value)
+                    if self.semantic and span_class == "python-txt" and token_type == "NAME":
+                        span_class = get_name_class(prev_token_value, "")
+                        if span_class == "python-txt":
+                            # Whether this name is a call site is only known
+                            # once the next token has been read
+                            pending_name = html_value
+                    if pending_name is None:
+                        self.add_html(f"<span class=\"{span_class}\">{spacer}{html_value}</span>")
 
                 prev_token_value = token_value
                 prev_token_start = token_start
@@ -295,7 +528,12 @@ class PythonParser:
 
                 token = next(self.tokens, None)
 
-                if not token or token_type == "ENDMARKER":
+                if pending_name is not None:
+                    span_class = get_name_class("", token.string if token else "")
+                    self.add_html(f"<span class=\"{span_class}\">{spacer}{pending_name}</span>")
+                    pending_name = None
+
+                if not token or token_map[token.type] == "ENDMARKER":
                     break
 
                 token_type = token_map[token.type]
@@ -304,43 +542,131 @@ class PythonParser:
                 token_start = token.start[1]
 
                 if token_start < prev_token_end:
-                    self.html += "<span class='python-op'>&nbsp;\\</span>"
-                    self.html += "</code>"
+                    self.add_html("<span class='python-op'>&nbsp;\\</span>")
+                    self.add_html("</code>")
                     self.line_number += 1
                     line_join = True
                 else:
                     line_join = False
 
             if not parse_broken:
-                self.html += "</code>"
+                self.add_html("</code>")
                 self.line_number += 1
 
     def add_html_meta(self) -> None:
         """
         Adds the metadata to the HTML string
         """
-        self.html += ("<!DOCTYPE html>\n"
-                      "<html lang='en'>\n"
-                      "    <head>\n"
-                      "    <meta charset='UTF-8'>\n"
-                      "    <meta http-equiv='X-UA-Compatible' content='IE=edge'>\n"
-                      "    <meta name='viewport' content='width=device-width, initial-scale=1.0'>\n"
-                      "    <title>SourcePage Output HTML</title>\n"
-                      "    <style>\n"
-                      f"{self.theme}\n"
-                      "    </style>\n"
-                      "    </head>\n"
-                      "    <body>\n"
-                      "        <div class='code-block python-code-block'>\n"
-                      )
+        self.add_html("<!DOCTYPE html>\n"
+                     "<html lang='en'>\n"
+                     "    <head>\n"
+                     "    <meta charset='UTF-8'>\n"
+                     "    <meta http-equiv='X-UA-Compatible' content='IE=edge'>\n"
+                     "    <meta name='viewport' content='width=device-width, initial-scale=1.0'>\n"
+                     "    <title>SourcePage Output HTML</title>\n"
+                     "    <style>\n"
+                     f"{self.theme}\n"
+                     "    </style>\n"
+                     "    </head>\n"
+                     "    <body>\n"
+                     )
+        if self.theme_names:
+            options = "".join(f"<option value='{theme_class(name)}'>{name}</option>" for name in self.theme_names)
+            self.add_html(f"    <div class='source-page {theme_class(self.theme_names[0])}'>\n"
+                         "        <select class='theme-select' "
+                         "onchange=\"this.parentNode.className = 'source-page ' + this.value\">"
+                         f"{options}</select>\n"
+                         )
+        self.add_html("        <div class='code-block python-code-block'>\n")
 
     def close_html(self) -> None:
         """
         Adds the closing tags to the HTML string
         """
-        self.html += ("        </div>\n"
-                      "    </body>\n"
-                      "</html>")
+        self.add_html("        </div>\n")
+        if self.theme_names:
+            self.add_html("    </div>\n")
+        self.add_html("    </body>\n"
+                     "</html>")
+
+    def generate_plain_html(self, lines: List[str]) -> str:
+        """
+        Generates a HTML representation of the Python source
+        code with line numbers but without syntax highlighting.
+        Used when a file cannot be tokenized or goes over the
+        limits set for rendering it
+
+        Args:
+            lines (List[str]): the lines of the source file
+        Returns:
+            Value of self.html
+        """
+        self.html = ""
+        self.line_number = 1
+        self.add_html_meta()
+        self.add_plain_lines(lines)
+        self.close_html()
+        return self.html
+
+    def add_plain_lines(self, lines: List[str]) -> None:
+        """
+        Adds a code block for each line of the source code with
+        the text escaped but not highlighted. The deadline is
+        checked every 1024 lines
+
+        Args:
+            lines (List[str]): the lines of the source file
+        Raises:
+            RenderBudgetExceeded: if the deadline has passed
+        """
+        max_lines = self.max_lines()
+        for index, line in enumerate(lines):
+            if index % 1024 == 0:
+                self.check_budget()
+            value = self.escape_value(line.rstrip("\r\n")).replace(" ", "&nbsp;")
+            self.add_html(f"<code class=\"code-line\">{self.line_number_html(max_lines)}"
+                          f"<span class=\"python-txt\">{value}</span></code>")
+            self.line_number += 1
+
+    def generate_fragment(self, theme_name: str, plain_lines: Optional[List[str]] = None) -> str:
+        """
+        Generates the HTML code block for the Python source code
+        without the surrounding page, for embedding in another
+        page. The block is wrapped in the root class of the theme
+        so it can be styled with the scoped theme stylesheets
+
+        Args:
+            theme_name (str): name of the theme, e.g. cool_blue
+            plain_lines (List[str]): lines to add without highlighting
+                                     instead of parsing the tokens
+        Returns:
+            Value of self.html
+        """
+        self.html = (f"<div class='source-page {theme_class(theme_name)}'>"
+                     "<div class='code-block python-code-block'>")
+        if plain_lines is None:
+            self.parse()
+        else:
+            self.add_plain_lines(plain_lines)
+        self.add_html("</div></div>")
+        return self.html
+
+    def generate_multi_theme_html(self, themes: Dict[str, str]) -> str:
+        """
+        Generates the HTML representation of the Python source
+        code once, with every theme given scoped under its own
+        root class. A select element on the page switches between
+        the themes in the browser
+
+        Args:
+            themes (Dict[str, str]): theme names mapped to their
+                                     stylesheets from themes.py
+        Returns:
+            Value of self.html
+        """
+        self.theme_names = list(themes)
+        self.theme = "\n".join(scope_theme(css, theme_class(name)) for name, css in themes.items())
+        return self.generate_html()
 
     def generate_html(self) -> str:
         """
@@ -35,6 +35,12 @@ COOL_BLUE = """
     .python-txt {
         color: skyblue;
     }
+    .python-func {
+        color: khaki;
+    }
+    .python-class {
+        color: mediumaquamarine;
+    }
     .python-op {
         color: #fff;
     }
@@ -95,6 +101,12 @@ COOL_BLUE_LIGHT = """
     .python-txt {
         color: deepskyblue;
     }
+    .python-func {
+        color: darkgoldenrod;
+    }
+    .python-class {
+        color: teal;
+    }
     .python-op {
         color: #666;
     }
@@ -155,6 +167,12 @@ ROBOT = """
     .python-txt {
         color: rgb(20, 189, 201);
     }
+    .python-func {
+        color: rgb(255, 166, 77);
+    }
+    .python-class {
+        color: rgb(120, 230, 170);
+    }
     .python-op {
         color: #fff;
     }
@@ -215,6 +233,12 @@ ROBOT_LIGHT = """
     .python-txt {
         color: rgb(20, 189, 201);
     }
+    .python-func {
+        color: rgb(214, 110, 0);
+    }
+    .python-class {
+        color: rgb(20, 140, 90);
+    }
     .python-op {
         color: #666;
     }
@@ -275,6 +299,12 @@ CYBER = """
     .python-txt {
         color: rgb(235, 245, 54);
     }
+    .python-func {
+        color: rgb(0, 255, 170);
+    }
+    .python-class {
+        color: rgb(255, 120, 120);
+    }
     .python-op {
         color: #777;
     }
@@ -3,35 +3,22 @@ Tokens and theme variable module
 """
 
 import token
-import tokenize
 
-# Merge both token and tokenize integer constants into a single mapping
-token_map = {}
+# Token type numbers mapped to their names. token.tok_name is the table
+# the standard library precomputes for this, covering the COMMENT, NL
+# and ENCODING types tokenize adds as well
+token_map = token.tok_name
 
-# From `token` module
-token_map.update({
-    value: name
-    for name, value in vars(token).items()
-    if isinstance(value, int)
-})
-
-# From `tokenize` module (these may overwrite or add to the above)
-token_map.update({
-    value: name
-    for name, value in vars(tokenize).items()
-    if isinstance(value, int)
-})
-
-keywords = [
+keywords = frozenset([
     "True",
     "False",
     "None",
     "def",
     "nonlocal",
     "lambda",
-    "async"]
+    "async"])
 
-special_keywords = [
+special_keywords = frozenset([
     "in",
     "is",
     "and",
@@ -59,9 +46,10 @@ special_keywords = [
     "if",
     "else",
     "elif",
-    "yield"]
+    "yield"])
 
 theme_list = [
+    "cool_blue",
     "cool_blue_light",
     "cyber",
     "robot",